@@ -0,0 +1,423 @@
+import argparse
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+PIPELINE_ID = 1
+PROJECT_ID = 1
+
+_timestamp = "2024-01-01T00:{0:02d}:{1:02d}.000Z"
+
+
+def _time(seconds):
+    return _timestamp.format(seconds // 60 % 60, seconds % 60)
+
+
+class FakeGitLab(object):
+    # Scripted state of a single GitLab project for the benchmarks. Pipelines
+    # and jobs advance through their statuses each time they are requested:
+    # a pipeline stays 'running' for PIPELINE_POLLS requests, a job stays
+    # 'running' for TRACE_STEPS requests and its trace grows by an equal
+    # fraction of TRACE_SIZE bytes with each of them. Each RETRY_EVERY-th job
+    # has a failed and retried previous attempt, and each pipeline triggers a
+    # child pipeline with CHILD_JOBS jobs.
+
+    def __init__(
+        self,
+        jobs=20,
+        trace_size=1 << 20,
+        trace_steps=4,
+        pipeline_polls=3,
+        retry_every=7,
+        child_jobs=5,
+    ):
+        self.job_count = jobs
+        self.trace_size = trace_size
+        self.trace_steps = max(trace_steps, 1)
+        self.pipeline_polls = pipeline_polls
+        self.retry_every = retry_every
+        self.child_jobs = child_jobs
+        self.lock = threading.Lock()
+        self.traces = {}
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.bytes = 0
+            self.pipelines = {}
+            self.jobs = {}
+            self.next_pipeline_id = PIPELINE_ID
+            self.next_job_id = 1
+        self.create_pipeline("main")
+
+    def create_pipeline(self, ref, sha=None, parent_id=None):
+        with self.lock:
+            pipeline_id = self.next_pipeline_id
+            self.next_pipeline_id += 1
+            pipeline = {
+                "id": pipeline_id,
+                "project_id": PROJECT_ID,
+                "ref": ref,
+                "sha": sha or "{0:040x}".format(pipeline_id),
+                "polls": 0,
+                "canceled": False,
+                "parent_id": parent_id,
+                "jobs": [],
+                "bridges": [],
+            }
+            self.pipelines[pipeline_id] = pipeline
+            prefix = "child-job" if parent_id else "job"
+            job_count = self.child_jobs if parent_id else self.job_count
+            for index in range(job_count):
+                retried = self.retry_every and index % self.retry_every == (
+                    self.retry_every // 2
+                )
+                for attempt in ([True] if retried else []) + [False]:
+                    job_id = self.next_job_id
+                    self.next_job_id += 1
+                    self.jobs[job_id] = {
+                        "id": job_id,
+                        "name": "{0}-{1}".format(prefix, index),
+                        "stage": "stage-{0}".format(index % 3),
+                        "pipeline_id": pipeline_id,
+                        "index": index,
+                        "polls": 0,
+                        "retried": attempt,
+                    }
+                    pipeline["jobs"].append(job_id)
+
+        if self.child_jobs and not parent_id:
+            child_id = self.create_pipeline(ref, pipeline["sha"], pipeline_id)
+            with self.lock:
+                pipeline["bridges"].append(
+                    {"id": self.next_job_id, "child_id": child_id}
+                )
+                self.next_job_id += 1
+        return pipeline_id
+
+    def pipeline_status(self, pipeline):
+        if pipeline["canceled"]:
+            return "canceled"
+        if pipeline["polls"] == 0:
+            return "created"
+        if pipeline["polls"] <= self.pipeline_polls:
+            return "running"
+        return "success"
+
+    def pipeline_json(self, pipeline):
+        return {
+            "id": pipeline["id"],
+            "iid": pipeline["id"],
+            "project_id": PROJECT_ID,
+            "ref": pipeline["ref"],
+            "sha": pipeline["sha"],
+            "status": self.pipeline_status(pipeline),
+            "web_url": "http://gitlab.invalid/pipelines/{0}".format(
+                pipeline["id"]
+            ),
+        }
+
+    def job_status(self, job):
+        pipeline = self.pipelines[job["pipeline_id"]]
+        if job["retried"]:
+            return "failed"
+        if pipeline["canceled"]:
+            return "canceled"
+        if job["polls"] > self.trace_steps or (
+            self.pipeline_status(pipeline) == "success"
+        ):
+            return "success"
+        if job["polls"] == 0:
+            return "pending"
+        return "running"
+
+    def job_json(self, job):
+        pipeline = self.pipelines[job["pipeline_id"]]
+        status = self.job_status(job)
+        index = job["index"]
+        created = 0
+        started = 10 + 5 * index
+        duration = 30 + 7 * (index % 5)
+        return {
+            "id": job["id"],
+            "name": job["name"],
+            "stage": job["stage"],
+            "status": status,
+            "allow_failure": False,
+            "created_at": _time(created),
+            "started_at": (
+                _time(started) if status not in ("pending",) else None
+            ),
+            "finished_at": (
+                _time(started + duration) if status == "success" else None
+            ),
+            "queued_duration": float(started - created),
+            "duration": float(duration) if status == "success" else None,
+            "pipeline": self.pipeline_json(pipeline),
+            "web_url": "http://gitlab.invalid/jobs/{0}".format(job["id"]),
+        }
+
+    def bridge_json(self, pipeline, bridge):
+        child = self.pipelines[bridge["child_id"]]
+        return {
+            "id": bridge["id"],
+            "name": "trigger-child",
+            "stage": "stage-0",
+            "status": self.pipeline_status(child),
+            "pipeline": self.pipeline_json(pipeline),
+            "downstream_pipeline": self.pipeline_json(child),
+        }
+
+    def trace(self, job):
+        full = self.traces.get(job["name"], None)
+        if full is None:
+            lines = []
+            size = 0
+            number = 0
+            while size < self.trace_size:
+                if number % 1000 == 999 and job["index"] % 10 == 0:
+                    line = "ERROR: step {0} failed\n".format(number)
+                else:
+                    line = "{0}: {1} line {2} of the job output\n".format(
+                        job["name"], "x" * (number % 64), number
+                    )
+                lines.append(line)
+                size += len(line)
+                number += 1
+            full = "".join(lines).encode()[: self.trace_size]
+            self.traces[job["name"]] = full
+        if self.job_status(job) in ("success", "canceled"):
+            return full
+        return full[
+            : len(full)
+            * min(job["polls"], self.trace_steps)
+            // self.trace_steps
+        ]
+
+    def handle(self, method, url, query, body):
+        # Returns a tuple of the status code, the response body and the extra
+        # headers:
+        path = re.sub(r"^https?://[^/]+", "", url)
+
+        # Control endpoints of the benchmark driver, which are not counted:
+        if path == "/__bench/stats":
+            return 200, {"requests": self.requests, "bytes": self.bytes}, {}
+        if path == "/__bench/reset" and method == "POST":
+            self.reset()
+            return 200, {}, {}
+        if path == "/__bench/finish" and method == "POST":
+            # Brings all pipelines and jobs to their final statuses:
+            with self.lock:
+                for pipeline in self.pipelines.values():
+                    pipeline["polls"] = self.pipeline_polls + 1
+            return 200, {}, {}
+
+        with self.lock:
+            self.requests += 1
+
+        path = re.sub(r"^/api/v4", "", path)
+        match = re.match(r"^/projects/[^/]+(/.*)$", path)
+        if not match:
+            return 404, {"message": "404 Not Found"}, {}
+        path = match.group(1)
+
+        match = re.match(r"^/pipelines/(\d+)(/.*)?$", path)
+        if match:
+            pipeline = self.pipelines.get(int(match.group(1)), None)
+            if pipeline is None:
+                return 404, {"message": "404 Pipeline Not Found"}, {}
+            rest = match.group(2) or ""
+            if method == "GET" and not rest:
+                with self.lock:
+                    pipeline["polls"] += 1
+                return 200, self.pipeline_json(pipeline), {}
+            if method == "POST" and rest == "/cancel":
+                pipeline["canceled"] = True
+                return 201, self.pipeline_json(pipeline), {}
+            if method == "GET" and rest == "/jobs":
+                include_retried = query.get("include_retried", [""])[0].lower()
+                jobs = [
+                    self.job_json(self.jobs[job_id])
+                    for job_id in reversed(pipeline["jobs"])
+                    if include_retried == "true"
+                    or not self.jobs[job_id]["retried"]
+                ]
+                scope = query.get("scope[]", None)
+                if scope:
+                    jobs = [job for job in jobs if job["status"] in scope]
+                return self.paginate(jobs, url, query)
+            if method == "GET" and rest == "/bridges":
+                bridges = [
+                    self.bridge_json(pipeline, bridge)
+                    for bridge in reversed(pipeline["bridges"])
+                ]
+                return self.paginate(bridges, url, query)
+            return 404, {"message": "404 Not Found"}, {}
+
+        if method == "GET" and path == "/pipelines":
+            # Child pipelines are not listed:
+            pipelines = [
+                self.pipeline_json(pipeline)
+                for pipeline in sorted(
+                    self.pipelines.values(), key=lambda p: -p["id"]
+                )
+                if not pipeline["parent_id"]
+                and pipeline["sha"] == query.get("sha", [pipeline["sha"]])[0]
+                and pipeline["ref"] == query.get("ref", [pipeline["ref"]])[0]
+            ]
+            return self.paginate(pipelines, url, query)
+
+        if method == "POST" and path in ("/pipeline", "/trigger/pipeline"):
+            ref = body.get("ref", query.get("ref", ["main"])[0])
+            pipeline = self.pipelines[self.create_pipeline(ref)]
+            return 201, self.pipeline_json(pipeline), {}
+
+        match = re.match(r"^/jobs/(\d+)(/trace)?$", path)
+        if match and method == "GET":
+            job = self.jobs.get(int(match.group(1)), None)
+            if job is None:
+                return 404, {"message": "404 Job Not Found"}, {}
+            if match.group(2):
+                return 200, self.trace(job), {"Content-Type": "text/plain"}
+            with self.lock:
+                job["polls"] += 1
+            return 200, self.job_json(job), {}
+
+        # All commits are assumed to exist in the repository:
+        match = re.match(r"^/repository/commits/([0-9a-f]+)$", path)
+        if match and method == "GET":
+            return 200, {"id": match.group(1)}, {}
+
+        # Creation of a reference starts a pipeline for it:
+        match = re.match(r"^/repository/(branches|tags)$", path)
+        if match and method == "POST":
+            name = body.get("branch", body.get("tag_name", None))
+            self.create_pipeline(name, body["ref"])
+            return 201, {"name": name, "commit": {"id": body["ref"]}}, {}
+
+        match = re.match(r"^/repository/(branches|tags)/(.+)$", path)
+        if match and method == "DELETE":
+            return 204, b"", {}
+
+        return 404, {"message": "404 Not Found"}, {}
+
+    def paginate(self, items, url, query):
+        per_page = int(query.get("per_page", ["20"])[0])
+        page = int(query.get("page", ["1"])[0])
+        total_pages = max((len(items) + per_page - 1) // per_page, 1)
+        headers = {
+            "X-Page": str(page),
+            "X-Per-Page": str(per_page),
+            "X-Total": str(len(items)),
+            "X-Total-Pages": str(total_pages),
+        }
+        if page < total_pages:
+            headers["X-Next-Page"] = str(page + 1)
+            headers["Link"] = '<{0}>; rel="next"'.format(
+                self.page_url(url, query, page + 1)
+            )
+        return 200, items[(page - 1) * per_page : page * per_page], headers
+
+    def page_url(self, url, query, page):
+        query = dict(query)
+        query["page"] = [str(page)]
+        return "{0}?{1}".format(
+            url,
+            "&".join(
+                "{0}={1}".format(k, v) for k, vs in query.items() for v in vs
+            ),
+        )
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def _serve(self):
+        state = self.server.state
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        body = {}
+        length = int(self.headers.get("Content-Length", 0) or 0)
+        if length:
+            raw = self.rfile.read(length)
+            try:
+                body = json.loads(raw)
+            except ValueError:
+                body = {k: v[0] for k, v in parse_qs(raw.decode()).items()}
+
+        status, content, headers = state.handle(
+            self.command,
+            "http://{0}:{1}{2}".format(
+                self.server.server_address[0],
+                self.server.server_address[1],
+                url.path,
+            ),
+            query,
+            body,
+        )
+        if not isinstance(content, bytes):
+            content = json.dumps(content).encode()
+            headers.setdefault("Content-Type", "application/json")
+
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+        if not url.path.startswith("/__bench/"):
+            with state.lock:
+                state.bytes += len(content)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _serve
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(state, host="127.0.0.1", port=0):
+    # Starts the server in a daemon thread and returns it; the URL of the
+    # server is 'http://{host}:{server.server_address[1]}':
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.state = state
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    # Runs the server in a separate process, so that its memory footprint does
+    # not affect the peak RSS measured for the benchmarked commands. The port
+    # of the server is printed to the standard output once it is ready.
+    parser = argparse.ArgumentParser(description="fake GitLab server")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--jobs", type=int, default=20)
+    parser.add_argument("--trace-size", type=int, default=1 << 20)
+    parser.add_argument("--trace-steps", type=int, default=4)
+    parser.add_argument("--pipeline-polls", type=int, default=3)
+    parser.add_argument("--retry-every", type=int, default=7)
+    parser.add_argument("--child-jobs", type=int, default=5)
+    args = parser.parse_args()
+
+    server = serve(
+        FakeGitLab(
+            jobs=args.jobs,
+            trace_size=args.trace_size,
+            trace_steps=args.trace_steps,
+            pipeline_polls=args.pipeline_polls,
+            retry_every=args.retry_every,
+            child_jobs=args.child_jobs,
+        ),
+        port=args.port,
+    )
+    print(server.server_address[1], flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,531 @@
+#!/usr/bin/env python3
+
+# Benchmarks of the gchl commands: each scenario runs bin/gchl against a local
+# fake GitLab server (see fake_gitlab.py) and local bare git repositories, and
+# records the wall time, the number of HTTP requests, the number of bytes sent
+# by the server and pushed by git, and the peak RSS of the command. The results
+# are compared with the baseline (see --save-baseline to update it).
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.request import Request, urlopen
+
+bench_path = os.path.dirname(os.path.realpath(os.path.expanduser(__file__)))
+gchl_prefix = os.path.dirname(bench_path)
+gchl_file = os.path.join(gchl_prefix, "bin", "gchl")
+
+sys.path.insert(0, os.path.join(gchl_prefix, "lib"))
+
+import cmd
+
+import fake_gitlab
+
+PROJECT_NAME = "bench/project"
+
+
+def git(*args, **kwargs):
+    subprocess.run(
+        ["git"] + list(args),
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        **kwargs
+    )
+
+
+def create_local_repo(path, commits, file_size):
+    # Creates a repository with the requested number of commits, each of them
+    # adds a file of pseudo-random (i.e. incompressible) content:
+    git("init", "-q", path)
+    git("-C", path, "config", "user.name", "gchl-bench")
+    git("-C", path, "config", "user.email", "gchl-bench@git-ci-hub-lab")
+    for i in range(commits):
+        with open(os.path.join(path, "file-{0}".format(i)), "wb") as f:
+            f.write(os.urandom(file_size))
+        git("-C", path, "add", "-A")
+        git("-C", path, "commit", "-q", "-m", "commit {0}".format(i))
+
+
+def create_remote_repo(path):
+    git("init", "-q", "--bare", path)
+
+
+# Scenarios: each function prepares the environment and returns the command
+# line arguments of gchl. There must be at least one scenario for each command
+# in cmd.commands.
+
+
+def scenario_g_push_rev(ctx):
+    create_remote_repo(ctx["remote"])
+    return [
+        "g-push-rev",
+        "--local-path={0}".format(ctx["local"]),
+        "--remote-url={0}".format(ctx["remote"]),
+        "--ref-name=bench",
+    ]
+
+
+def scenario_g_push_rev_up_to_date(ctx):
+    create_remote_repo(ctx["remote"])
+    git("-C", ctx["local"], "push", "-q", ctx["remote"], "HEAD:refs/tags/bench")
+    return [
+        "g-push-rev",
+        "--local-path={0}".format(ctx["local"]),
+        "--remote-url={0}".format(ctx["remote"]),
+        "--ref-name=bench",
+    ]
+
+
+def scenario_g_push_rev_gitlab_api(ctx):
+    create_remote_repo(ctx["remote"])
+    return [
+        "g-push-rev",
+        "--local-path={0}".format(ctx["local"]),
+        "--remote-url={0}".format(ctx["remote"]),
+        "--ref-name=bench",
+        "--gitlab-server-url={0}".format(ctx["server_url"]),
+        "--gitlab-project-name={0}".format(PROJECT_NAME),
+        "--gitlab-token=bench",
+        "--gitlab-create-ref",
+    ]
+
+
+def scenario_g_push_rev_attach(ctx):
+    return scenario_g_push_rev_gitlab_api(ctx) + [
+        "--attach",
+        "--poll-timeout=0",
+    ]
+
+
+def scenario_g_delete_ref(ctx):
+    create_remote_repo(ctx["remote"])
+    git("-C", ctx["local"], "push", "-q", ctx["remote"], "HEAD:refs/tags/bench")
+    return [
+        "g-delete-ref",
+        "--remote-url={0}".format(ctx["remote"]),
+        "--ref-type=tag",
+        "--ref-name=bench",
+    ]
+
+
+def gitlab_args(ctx):
+    return [
+        "--server-url={0}".format(ctx["server_url"]),
+        "--project-name={0}".format(PROJECT_NAME),
+        "--token=bench",
+    ]
+
+
+def scenario_gl_create_pipeline(ctx):
+    return (
+        ["gl-create-pipeline"]
+        + gitlab_args(ctx)
+        + ["--ref-name=main", "--attach", "--poll-timeout=0"]
+    )
+
+
+def scenario_gl_create_pipeline_report(ctx):
+    return scenario_gl_create_pipeline(ctx) + [
+        "--report-file={0}".format(
+            os.path.join(os.path.dirname(ctx["remote"]), "report.json")
+        )
+    ]
+
+
+def scenario_gl_trigger_pipeline(ctx):
+    return ["gl-trigger-pipeline"] + gitlab_args(ctx) + ["--ref-name=main"]
+
+
+def scenario_gl_cancel_pipeline(ctx):
+    return (
+        ["gl-cancel-pipeline"]
+        + gitlab_args(ctx)
+        + ["--pipeline-id={0}".format(fake_gitlab.PIPELINE_ID)]
+    )
+
+
+def scenario_gl_attach_job(ctx):
+    return (
+        ["gl-attach-job"]
+        + gitlab_args(ctx)
+        + [
+            "--pipeline-id={0}".format(fake_gitlab.PIPELINE_ID),
+            "--job-name=job-0",
+            "--poll-timeout=0",
+        ]
+    )
+
+
+def scenario_gl_attach_job_child(ctx):
+    # The job is in the child pipeline and has a retried previous attempt:
+    return (
+        ["gl-attach-job"]
+        + gitlab_args(ctx)
+        + [
+            "--pipeline-id={0}".format(fake_gitlab.PIPELINE_ID),
+            "--job-name=child-job-3",
+            "--poll-timeout=0",
+        ]
+    )
+
+
+def scenario_gl_attach_job_resume(ctx):
+    # Half of the trace is already reported by a previous run:
+    state_file = os.path.join(os.path.dirname(ctx["remote"]), "state.json")
+    with open(state_file, "w") as f:
+        json.dump({"jobs": {"1:job-0": 1}, "offsets": {"1": 1 << 19}}, f)
+    return scenario_gl_attach_job(ctx) + ["--state-file={0}".format(state_file)]
+
+
+def scenario_gl_attach_job_tail(ctx):
+    return scenario_gl_attach_job(ctx) + ["--tail=100"]
+
+
+def scenario_gl_grep_traces(ctx):
+    server_request(ctx["server_url"], "/__bench/finish", "POST")
+    return (
+        ["gl-grep-traces"]
+        + gitlab_args(ctx)
+        + [
+            "--pipeline-id={0}".format(fake_gitlab.PIPELINE_ID),
+            "--pattern=ERROR: step [0-9]+ failed",
+            "--job-status=success",
+            "--job-name=job-1*",
+            "--context=2",
+        ]
+    )
+
+
+def scenario_gl_create_ref(ctx):
+    return (
+        ["gl-create-ref"]
+        + gitlab_args(ctx)
+        + [
+            "--ref-type=tag",
+            "--ref-name=bench",
+            "--ref-commit={0:040x}".format(1),
+            "--ref-message=bench",
+        ]
+    )
+
+
+def scenario_gl_delete_ref(ctx):
+    return (
+        ["gl-delete-ref"]
+        + gitlab_args(ctx)
+        + ["--ref-type=branch", "--ref-name=bench"]
+    )
+
+
+scenarios = {
+    "g-push-rev": scenario_g_push_rev,
+    "g-push-rev (up to date)": scenario_g_push_rev_up_to_date,
+    "g-push-rev (GitLab API)": scenario_g_push_rev_gitlab_api,
+    "g-push-rev (attach)": scenario_g_push_rev_attach,
+    "g-delete-ref": scenario_g_delete_ref,
+    "gl-create-pipeline": scenario_gl_create_pipeline,
+    "gl-create-pipeline (report)": scenario_gl_create_pipeline_report,
+    "gl-trigger-pipeline": scenario_gl_trigger_pipeline,
+    "gl-cancel-pipeline": scenario_gl_cancel_pipeline,
+    "gl-attach-job": scenario_gl_attach_job,
+    "gl-attach-job (child)": scenario_gl_attach_job_child,
+    "gl-attach-job (resume)": scenario_gl_attach_job_resume,
+    "gl-attach-job (tail)": scenario_gl_attach_job_tail,
+    "gl-grep-traces": scenario_gl_grep_traces,
+    "gl-create-ref": scenario_gl_create_ref,
+    "gl-delete-ref": scenario_gl_delete_ref,
+}
+
+
+def run_gchl(argv, workdir):
+    # Runs gchl and returns its exit code, wall time in seconds, peak RSS in
+    # kilobytes and the metrics reported by the command:
+    metrics_file = os.path.join(workdir, "metrics.json")
+    with open(os.path.join(workdir, "output.txt"), "w") as output:
+        start = time.monotonic()
+        process = subprocess.Popen(
+            [sys.executable, gchl_file, "--metrics-file", metrics_file] + argv,
+            stdout=output,
+            stderr=subprocess.STDOUT,
+        )
+        _, status, rusage = os.wait4(process.pid, 0)
+        wall_time = time.monotonic() - start
+        process.returncode = (
+            os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+        )
+
+    metrics = {}
+    if os.path.exists(metrics_file):
+        with open(metrics_file) as f:
+            metrics = json.load(f)
+
+    peak_rss = rusage.ru_maxrss
+    if sys.platform == "darwin":
+        # Reported in bytes on macOS:
+        peak_rss //= 1024
+
+    return process.returncode, wall_time, peak_rss, metrics
+
+
+def server_request(server_url, path, method="GET"):
+    with urlopen(Request(server_url + path, method=method)) as response:
+        return json.load(response)
+
+
+def run_scenario(name, server_url, args):
+    results = []
+    for _ in range(args.repeat):
+        server_request(server_url, "/__bench/reset", "POST")
+        with tempfile.TemporaryDirectory(prefix="gchl-bench-") as d:
+            ctx = {
+                "local": args.local_repo,
+                "remote": os.path.join(d, "remote.git"),
+                "server_url": server_url,
+            }
+            argv = scenarios[name](ctx)
+            exit_code, wall_time, peak_rss, metrics = run_gchl(argv, d)
+            stats = server_request(server_url, "/__bench/stats")
+            if exit_code != 0:
+                with open(os.path.join(d, "output.txt")) as f:
+                    sys.stderr.write(f.read())
+                raise RuntimeError(
+                    "scenario '{0}' failed with exit code {1}".format(
+                        name, exit_code
+                    )
+                )
+            counters = metrics.get("counters", {})
+            results.append(
+                {
+                    "wall_time": wall_time,
+                    "http_requests": stats["requests"],
+                    "http_bytes": stats["bytes"],
+                    "push_bytes": counters.get("push.bytes", 0),
+                    "peak_rss_kib": peak_rss,
+                }
+            )
+    # The fastest run is the least noisy estimate of the wall time, the rest
+    # of the values are deterministic or close to it:
+    return min(results, key=lambda r: r["wall_time"])
+
+
+def compare(results, baseline, tolerance, wall_slack):
+    # Returns the list of regressions against the baseline:
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name, None)
+        if base is None:
+            continue
+        if result["wall_time"] > (
+            base["wall_time"] * (1 + tolerance) + wall_slack
+        ):
+            regressions.append(
+                "{0}: wall time {1:.3f}s > {2:.3f}s".format(
+                    name, result["wall_time"], base["wall_time"]
+                )
+            )
+        for key in ("http_requests", "http_bytes", "push_bytes"):
+            if result[key] > base[key] * (1 + tolerance):
+                regressions.append(
+                    "{0}: {1} {2} > {3}".format(
+                        name, key, result[key], base[key]
+                    )
+                )
+        if result["peak_rss_kib"] > base["peak_rss_kib"] * (1 + tolerance):
+            regressions.append(
+                "{0}: peak RSS {1} KiB > {2} KiB".format(
+                    name, result["peak_rss_kib"], base["peak_rss_kib"]
+                )
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks of the gchl commands against a local fake "
+        "GitLab server and local bare git repositories"
+    )
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=sorted(scenarios),
+        help="scenario to run (can be repeated, default: all scenarios)",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="number of runs of each scenario (default: '%(default)s')",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=20,
+        help="number of jobs in each pipeline (default: '%(default)s')",
+    )
+    parser.add_argument(
+        "--trace-size",
+        type=int,
+        default=8 << 20,
+        help="size of each job trace in bytes (default: '%(default)s')",
+    )
+    parser.add_argument(
+        "--trace-steps",
+        type=int,
+        default=4,
+        help="number of polls, during which a job trace grows "
+        "(default: '%(default)s')",
+    )
+    parser.add_argument(
+        "--pipeline-polls",
+        type=int,
+        default=3,
+        help="number of polls, during which a pipeline is running "
+        "(default: '%(default)s')",
+    )
+    parser.add_argument(
+        "--retry-every",
+        type=int,
+        default=7,
+        help="each RETRY_EVERY-th job of a pipeline has a retried previous "
+        "attempt (default: '%(default)s')",
+    )
+    parser.add_argument(
+        "--child-jobs",
+        type=int,
+        default=5,
+        help="number of jobs in the child pipeline triggered by each pipeline "
+        "(default: '%(default)s')",
+    )
+    parser.add_argument(
+        "--commits",
+        type=int,
+        default=20,
+        help="number of commits in the local repository "
+        "(default: '%(default)s')",
+    )
+    parser.add_argument(
+        "--file-size",
+        type=int,
+        default=64 << 10,
+        help="size of the file added by each commit in bytes "
+        "(default: '%(default)s')",
+    )
+    parser.add_argument(
+        "--baseline",
+        default=os.path.join(bench_path, "baseline.json"),
+        help="baseline file to compare the results with "
+        "(default: '%(default)s')",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="save the results to BASELINE instead of comparing them "
+        "(default: '%(default)s')",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="relative increase of a value that is reported as a regression "
+        "(default: '%(default)s')",
+    )
+    parser.add_argument(
+        "--wall-slack",
+        type=float,
+        default=0.1,
+        help="absolute increase of the wall time in seconds that is tolerated "
+        "on top of TOLERANCE to filter out the noise of short runs "
+        "(default: '%(default)s')",
+    )
+    args = parser.parse_args()
+
+    missing = set(cmd.commands) - set(
+        scenario.split()[0] for scenario in scenarios
+    )
+    if missing:
+        raise RuntimeError(
+            "no scenarios for commands: {0}".format(", ".join(sorted(missing)))
+        )
+
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            fake_gitlab.__file__,
+            "--jobs={0}".format(args.jobs),
+            "--trace-size={0}".format(args.trace_size),
+            "--trace-steps={0}".format(args.trace_steps),
+            "--pipeline-polls={0}".format(args.pipeline_polls),
+            "--retry-every={0}".format(args.retry_every),
+            "--child-jobs={0}".format(args.child_jobs),
+        ],
+        stdout=subprocess.PIPE,
+    )
+    try:
+        server_url = "http://127.0.0.1:{0}".format(
+            int(server.stdout.readline())
+        )
+
+        results = {}
+        with tempfile.TemporaryDirectory(prefix="gchl-bench-") as d:
+            args.local_repo = os.path.join(d, "local")
+            create_local_repo(args.local_repo, args.commits, args.file_size)
+
+            row = "{0:<28} {1:>9} {2:>9} {3:>12} {4:>12} {5:>12}"
+            print(
+                row.format(
+                    "scenario",
+                    "wall, s",
+                    "requests",
+                    "http bytes",
+                    "push bytes",
+                    "peak RSS, KiB",
+                )
+            )
+            for name in args.scenario or scenarios:
+                result = run_scenario(name, server_url, args)
+                results[name] = result
+                print(
+                    row.format(
+                        name,
+                        "{0:.3f}".format(result["wall_time"]),
+                        result["http_requests"],
+                        result["http_bytes"],
+                        result["push_bytes"],
+                        result["peak_rss_kib"],
+                    ),
+                    flush=True,
+                )
+    finally:
+        server.terminate()
+        server.wait()
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        return
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(
+            results, baseline, args.tolerance, args.wall_slack
+        )
+        for regression in regressions:
+            print("Regression: {0}".format(regression), file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
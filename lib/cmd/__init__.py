@@ -7,6 +7,8 @@ commands = [
     "gl-trigger-pipeline",
     "gl-cancel-pipeline",
     "gl-attach-job",
+    "gl-grep-traces",
+    "gl-create-ref",
     "gl-delete-ref",
 ]
 
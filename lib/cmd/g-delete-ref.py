@@ -11,6 +11,7 @@ from common import (
     git_config,
     git_remote,
     info,
+    metrics_span,
     warn,
 )
 
@@ -99,9 +100,10 @@ def cmd(args):
                 if args.password is not None:
                     os.environ[password_variable] = args.password
                 try:
-                    remote.push(
-                        ":refs/{0}/{1}".format(ref_namespace, args.ref_name)
-                    ).raise_if_error()
+                    with metrics_span("push"):
+                        remote.push(
+                            ":refs/{0}/{1}".format(ref_namespace, args.ref_name)
+                        ).raise_if_error()
                     info(
                         "{0}{1} '{2}' is successfully deleted".format(
                             args.ref_type[0].upper(),
@@ -1,20 +1,39 @@
 import base64
+import hashlib
 import os
 import random
+import re
 import string
+import tempfile
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 
 from common import (
     BRANCH,
+    PIPELINE_SUCCESS,
     SIGNING_FORMAT_NONE,
     SIGNING_FORMAT_SSH,
     TAG,
+    GHCLAssertionError,
     git_config,
     git_keep_head,
     git_ref_exists_and_unique,
     git_remote,
     git_signing,
+    gitlab_attach_pipeline,
+    gitlab_commit_exists,
+    gitlab_create_ref,
+    gitlab_report_pipeline,
+    gitlab_server,
     info,
+    metrics_count,
+    metrics_span,
+    parse_size,
+    poll_sleep,
+    progress,
+    warn,
 )
 
 description = (
@@ -29,16 +48,25 @@ def setup_parser(parser):
         help="local repository path (default: '%(default)s')",
     )
     parser.add_argument(
-        "--remote-url", required=True, help="remote repository URL"
+        "--remote-url",
+        required=True,
+        action="append",
+        metavar="REMOTE_URL",
+        help="remote repository URL (can be repeated to push REV_ID to "
+        "several remote repositories concurrently)",
     )
     parser.add_argument(
         "--username",
-        default="token",
-        help="remote repository username (default: '%(default)s')",
+        action="append",
+        help="remote repository username (can be repeated to set a separate "
+        "username for each REMOTE_URL in the same order, default: 'token')",
     )
     parser.add_argument(
         "--password",
-        help="remote repository password (default: $GCHL_PASSWORD)",
+        action="append",
+        help="remote repository password (can be repeated to set a separate "
+        "password for each REMOTE_URL in the same order, "
+        "default: $GCHL_PASSWORD)",
     )
     parser.add_argument(
         "--rev-id",
@@ -62,6 +90,30 @@ def setup_parser(parser):
         "to the remote repository (ignored if REV_SIGNING_FORMAT is '{0}', "
         "default: $GCHL_REV_SIGNING_KEY)".format(SIGNING_FORMAT_NONE),
     )
+    parser.add_argument(
+        "--rev-signing-cache",
+        action="store_true",
+        help="reuse the signed commits recorded in the notes reference "
+        "'{0}' of the local repository for the same key instead of signing "
+        "the commits again, and record the newly signed commits there; the "
+        "notes reference also keeps the signed commits from being "
+        "garbage-collected and needs to be fetched before and pushed after "
+        "the command for the cache to survive fresh clones of the repository "
+        "(ignored if REV_SIGNING_FORMAT is '{1}', "
+        "default: '%(default)s')".format(
+            SIGNING_CACHE_REF, SIGNING_FORMAT_NONE
+        ),
+    )
+    parser.add_argument(
+        "--rev-signing-base",
+        metavar="REV_SIGNING_BASE",
+        help="ID of the base revision as understood by git-rev-parse: if "
+        "provided, all commits that are reachable from REV_ID but not from "
+        "REV_SIGNING_BASE are signed in one pass, parents first, instead of "
+        "REV_ID only (ignored if REV_SIGNING_FORMAT is '{0}')".format(
+            SIGNING_FORMAT_NONE
+        ),
+    )
     ref_types = [TAG, BRANCH]
     parser.add_argument(
         "--ref-type",
@@ -103,6 +155,88 @@ def setup_parser(parser):
         help="force push the reference to the remote repository "
         "(default: '%(default)s')",
     )
+    parser.add_argument(
+        "--push-option",
+        metavar="PUSH_OPTION",
+        action="append",
+        help="option to transmit to the remote repository with the push, e.g. "
+        "'ci.skip' or 'ci.variable=NAME=VALUE' for GitLab (can be repeated)",
+    )
+    parser.add_argument(
+        "--recurse-submodules",
+        action="store_true",
+        help="push the commits of the submodules referenced by REV_ID to their "
+        "remote repositories concurrently before pushing REV_ID: each commit "
+        "is pushed as a lightweight tag SUBMODULE_REF_PREFIX followed by "
+        "SHA-1 of the commit, which is never force-pushed, the remote URLs are "
+        "taken from '.gitmodules' of REV_ID (relative URLs are resolved "
+        "against each REMOTE_URL) unless SUBMODULE_REMOTE_URL is provided "
+        "(default: '%(default)s')",
+    )
+    parser.add_argument(
+        "--submodule-ref-prefix",
+        metavar="SUBMODULE_REF_PREFIX",
+        default="gchl-",
+        help="prefix of the tags the commits of the submodules are pushed as "
+        "(ignored without --recurse-submodules, default: '%(default)s')",
+    )
+    parser.add_argument(
+        "--submodule-remote-url",
+        metavar="SUBMODULE_REMOTE_URL",
+        action="append",
+        help="remote repository URL for a submodule in the format PATH=URL, "
+        "where PATH is the path to the submodule in REV_ID (can be repeated, "
+        "ignored without --recurse-submodules)",
+    )
+    parser.add_argument(
+        "--gitlab-server-url",
+        help="GitLab server URL (required for --gitlab-create-ref and "
+        "--find-pipeline)",
+    )
+    parser.add_argument(
+        "--gitlab-project-name",
+        help="GitLab project name that corresponds to (one of) REMOTE_URL "
+        "(required for --gitlab-create-ref and --find-pipeline)",
+    )
+    parser.add_argument(
+        "--gitlab-token",
+        help="GitLab access token (default: $GCHL_GITLAB_TOKEN)",
+    )
+    parser.add_argument(
+        "--gitlab-create-ref",
+        action="store_true",
+        help="create the reference with the GitLab API instead of the git push "
+        "when the commit already exists in the GitLab repository (requires "
+        "GITLAB_SERVER_URL, GITLAB_PROJECT_NAME and a single REMOTE_URL, "
+        "ignored if --force-push or PUSH_OPTION is set or REF_SIGNING_FORMAT "
+        "is not '{0}', default: '%(default)s')".format(SIGNING_FORMAT_NONE),
+    )
+    parser.add_argument(
+        "--find-pipeline",
+        action="store_true",
+        help="find the GitLab CI pipeline created for the pushed commit and "
+        "reference, and report its ID and SHA-1 (requires GITLAB_SERVER_URL "
+        "and GITLAB_PROJECT_NAME, default: '%(default)s')",
+    )
+    parser.add_argument(
+        "--pipeline-timeout",
+        type=int,
+        default=60,
+        help="time in seconds to wait for the pipeline to appear "
+        "(default: '%(default)s')",
+    )
+    parser.add_argument(
+        "--attach",
+        action="store_true",
+        help="wait for the found pipeline and report its final status "
+        "(implies --find-pipeline, default: '%(default)s')",
+    )
+    parser.add_argument(
+        "--poll-timeout",
+        type=int,
+        default=10,
+        help="pipeline status poll timeout in seconds (default: '%(default)s')",
+    )
     parser.add_argument(
         "--safe-path",
         action="store_true",
@@ -113,37 +247,807 @@ def setup_parser(parser):
     )
 
 
+# Notes reference that maps original commits to their signed counterparts:
+SIGNING_CACHE_REF = "refs/notes/gchl-signed-commits"
+
+_author_regex = re.compile(rb"^(.*) <(.*)> (\d+ [+-]\d{4})$")
+
+
+def read_commit(repo, commit):
+    # Returns the tree, the list of parents, the author match object, the raw
+    # message and the encoding (None if not specified) of the commit or None if
+    # the commit does not exist. The raw object is read via the persistent
+    # 'git cat-file --batch' process and parsed as bytes since neither the
+    # header nor the message are required to be in UTF-8.
+    from git.exc import BadName, BadObject
+
+    try:
+        raw = repo.odb.stream(bytes.fromhex(commit)).read()
+    except (BadName, BadObject):
+        return None
+    header, _, message = raw.partition(b"\n\n")
+    tree = None
+    parents = []
+    author = None
+    encoding = None
+    for line in header.split(b"\n"):
+        key, _, value = line.partition(b" ")
+        if key == b"tree":
+            tree = value.decode()
+        elif key == b"parent":
+            parents.append(value.decode())
+        elif key == b"author":
+            author = _author_regex.match(value)
+        elif key == b"encoding":
+            encoding = value.decode()
+
+    if tree is None or author is None:
+        raise GHCLAssertionError(
+            "unexpected format of commit {0}".format(commit)
+        )
+
+    return tree, parents, author, message, encoding
+
+
+def sign_commits(repo, commits, cached=None):
+    # Re-creates the commits, which must be listed parents first, as signed
+    # ones and returns a dictionary that maps SHA-1 of the original commits to
+    # SHA-1 of the signed ones. The parents of each re-created commit are
+    # replaced with their signed counterparts when available. The tree, the
+    # author, the message and the encoding of the original commits are
+    # preserved byte for byte, the committer is taken from the git
+    # configuration. A signed commit from the cached dictionary is reused
+    # instead if it has the same tree and parents.
+    cached = cached or {}
+    signed = {}
+    for commit in commits:
+        tree, parents, author, message, encoding = read_commit(repo, commit)
+        parents = [signed.get(parent, parent) for parent in parents]
+
+        candidate = cached.get(commit, None)
+        if candidate:
+            candidate_info = read_commit(repo, candidate)
+            if candidate_info and candidate_info[:2] == (tree, parents):
+                signed[commit] = candidate
+                continue
+
+        parent_args = []
+        for parent in parents:
+            parent_args.extend(["-p", parent])
+
+        # The message is passed via the standard input to keep it intact and
+        # the author is passed via the environment decoded with the filesystem
+        # encoding, which is reverted when the environment is passed to git:
+        git = repo.git
+        if encoding:
+            git = git(c="i18n.commitEncoding={0}".format(encoding))
+        with tempfile.TemporaryFile() as message_file:
+            message_file.write(message)
+            message_file.seek(0)
+            # TODO: handle erroneous zero exit code from git, which happens when
+            #  ssh-keygen is unable to find the key
+            signed[commit] = git.commit_tree(
+                tree,
+                *parent_args,
+                "-S",
+                istream=message_file,
+                env={
+                    "GIT_AUTHOR_NAME": os.fsdecode(author.group(1)),
+                    "GIT_AUTHOR_EMAIL": os.fsdecode(author.group(2)),
+                    "GIT_AUTHOR_DATE": os.fsdecode(author.group(3)),
+                },
+            )
+
+    return signed
+
+
+def signing_fingerprint(signing_format, signing_key):
+    return "{0}:{1}".format(
+        signing_format, hashlib.sha256(signing_key or b"").hexdigest()
+    )
+
+
+def read_signing_cache(repo, commits, fingerprint):
+    # Returns a dictionary that maps the commits to their signed counterparts
+    # recorded in the notes for the fingerprint of the signing key, a
+    # dictionary that maps the commits to the lines of their notes and the
+    # commit the notes reference points to (None if there is no such
+    # reference). Each note consists of lines '<fingerprint> <signed commit>'.
+    from git.exc import GitCommandError
+
+    try:
+        tip = repo.git.rev_parse("--verify", "--quiet", SIGNING_CACHE_REF)
+    except GitCommandError:
+        return {}, {}, None
+
+    notes = {}
+    for line in repo.git.notes("--ref", SIGNING_CACHE_REF, "list").split("\n"):
+        if line:
+            note, annotated = line.split()
+            notes[annotated] = note
+
+    cached = {}
+    contents = {}
+    for commit in commits:
+        note = notes.get(commit, None)
+        if note:
+            content = repo.odb.stream(bytes.fromhex(note)).read().decode()
+            contents[commit] = [line for line in content.split("\n") if line]
+            for line in contents[commit]:
+                entry = line.split()
+                if len(entry) == 2 and entry[0] == fingerprint:
+                    cached[commit] = entry[1]
+    return cached, contents, tip
+
+
+def write_signing_cache(
+    repo, signed, signed_tip, cached, contents, tip, fingerprint
+):
+    # Records the newly signed commits in the notes, keeping the entries for
+    # other fingerprints. All notes are written with a single notes commit via
+    # git-fast-import, which also takes care of the fan-out of the notes tree
+    # and refuses to update the reference if it has been moved since it was
+    # read (the cache is not updated then). The notes are not enough to keep
+    # the signed commits, which are not referenced otherwise once the push is
+    # over, from being garbage-collected. Therefore, the signed commit all the
+    # other signed ones are reachable from is added as a parent of the notes
+    # commit:
+    from git.exc import GitCommandError
+
+    updates = []
+    for commit, signed_commit in signed.items():
+        if cached.get(commit, None) == signed_commit:
+            continue
+        lines = [
+            line
+            for line in contents.get(commit, [])
+            if not line.startswith(fingerprint + " ")
+        ]
+        lines.append("{0} {1}".format(fingerprint, signed_commit))
+        content = "\n".join(lines).encode() + b"\n"
+        updates.append(
+            b"N inline %s\ndata %d\n%s\n"
+            % (commit.encode(), len(content), content)
+        )
+
+    if not updates:
+        return
+
+    message = b"Notes added by 'g-push-rev'\n"
+    script = [
+        b"commit %s\n" % SIGNING_CACHE_REF.encode(),
+        b"committer %s\n" % repo.git.var("GIT_COMMITTER_IDENT").encode(),
+        b"data %d\n%s\n" % (len(message), message),
+    ]
+    if tip:
+        script.append(b"from %s\n" % tip.encode())
+    script.append(b"merge %s\n" % signed_tip.encode())
+    script.extend(updates)
+
+    with tempfile.TemporaryFile() as script_file:
+        script_file.writelines(script)
+        script_file.seek(0)
+        try:
+            repo.git.fast_import("--quiet", istream=script_file)
+        except GitCommandError as e:
+            warn(
+                "Failed to update the signing cache '{0}': {1}".format(
+                    SIGNING_CACHE_REF, e
+                )
+            )
+
+
+def full_ref_name(ref_type, ref_name):
+    if ref_type == BRANCH:
+        return "refs/heads/{0}".format(ref_name)
+    elif ref_type == TAG:
+        return "refs/tags/{0}".format(ref_name)
+    raise GHCLAssertionError("unexpected reference type {0}".format(ref_type))
+
+
+def remote_ref_commit(repo, remote_url, ref_type, ref_name):
+    # Returns SHA-1 of the commit the reference in the remote repository points
+    # (or, in the case of a tag, peels) to or None if there is no such
+    # reference or the remote repository could not be queried (the subsequent
+    # push reports the actual error then):
+    from git.exc import GitCommandError
+
+    ref_path = full_ref_name(ref_type, ref_name)
+
+    try:
+        with metrics_span("ls_remote"):
+            output = repo.git.ls_remote(remote_url, ref_path, ref_path + "^{}")
+    except GitCommandError:
+        return None
+
+    refs = {}
+    for line in output.split("\n"):
+        if line:
+            sha, path = line.split("\t")
+            refs[path] = sha
+    return refs.get(ref_path + "^{}", refs.get(ref_path, None))
+
+
+def write_outputs(ref_type, ref_name, commit):
+    # TODO: make it more generic
+    if "GITHUB_OUTPUT" in os.environ:
+        with open(os.environ["GITHUB_OUTPUT"], "a") as f:
+            f.writelines(
+                [
+                    "ref-type={0}\n".format(ref_type),
+                    "ref-name={0}\n".format(ref_name),
+                    "ref-commit={0}\n".format(commit),
+                ]
+            )
+
+
+def per_remote(values, remote_urls, name):
+    # Returns a list with a value for each remote URL: a single value is used
+    # for all of them:
+    if values is None or len(values) == len(remote_urls):
+        return values or [None] * len(remote_urls)
+    if len(values) == 1:
+        return values * len(remote_urls)
+    raise GHCLAssertionError(
+        "the number of {0} values ({1}) does not match the number of remote "
+        "URLs ({2})".format(name, len(values), len(remote_urls))
+    )
+
+
+def display_url(url):
+    # Removes the credentials from the URL:
+    return re.sub(r"(://)[^/@]*@", r"\1", url)
+
+
+def url_host(url):
+    # Returns the scheme and the host of the URL or None if the URL is a local
+    # path:
+    match = re.match(r"^([a-z][a-z0-9+.-]*://)(?:[^/@]*@)?([^/]*)", url)
+    if match:
+        return match.group(1) + match.group(2)
+    # The scp-like syntax:
+    match = re.match(r"^(?:[^/@:]*@)?([^/:]+):", url)
+    if match:
+        return "ssh://" + match.group(1)
+    return None
+
+
+def credential_config(remote_url, username, password_variable):
+    # Returns the name and the options of the credential section in the git
+    # configuration that makes git read the password to the remote repository
+    # from the environment variable:
+    return 'credential "{0}"'.format(remote_url), {
+        "username": username,
+        "helper": '"!f() {{'
+        ' test \\"${{1}}\\" = get && echo \\"password=${{{0}}}\\"; '
+        '}}; f"'.format(password_variable),
+    }
+
+
+def resolve_submodule_url(base_url, url):
+    # Resolves the relative submodule URL against the URL of the superproject
+    # the way git does it: './' refers to the superproject URL itself and each
+    # '../' strips one component of it.
+    base_url = base_url.rstrip("/")
+    while True:
+        if url.startswith("./"):
+            url = url[2:]
+        elif url.startswith("../"):
+            url = url[3:]
+            match = re.match(r"^(.*[/:])[^/:]+$", base_url)
+            if not match:
+                raise GHCLAssertionError(
+                    "cannot strip a component of URL '{0}'".format(
+                        display_url(base_url)
+                    )
+                )
+            base_url = match.group(1)
+            if base_url.endswith("/"):
+                base_url = base_url[:-1]
+        else:
+            break
+    if base_url.endswith(":"):
+        return base_url + url
+    return base_url + "/" + url
+
+
+def find_submodules(repo, commit, remote_urls, mapped_urls):
+    # Returns a list of tuples (path, SHA-1 of the referenced commit, local
+    # repository, list of targets) for the submodules referenced by the commit.
+    # Each target is a tuple of the remote URL and the index of the remote URL
+    # of the superproject the credentials of which are used for it (or None).
+    from git import Repo
+    from git.exc import (
+        GitCommandError,
+        InvalidGitRepositoryError,
+        NoSuchPathError,
+    )
+
+    # Submodule names and URLs from '.gitmodules' of the commit:
+    try:
+        commit.tree[".gitmodules"]
+    except KeyError:
+        has_gitmodules = False
+        config = ""
+    else:
+        has_gitmodules = True
+        try:
+            config = repo.git.config(
+                "-z",
+                "--blob",
+                "{0}:.gitmodules".format(commit.hexsha),
+                "--get-regexp",
+                r"^submodule\..*\.(path|url)$",
+            )
+        except GitCommandError:
+            config = ""
+    names = {}
+    urls = {}
+    for entry in config.split("\0"):
+        if entry:
+            key, _, value = entry.partition("\n")
+            name, _, option = key[len("submodule.") :].rpartition(".")
+            if option == "path":
+                names[value] = name
+            else:
+                urls[name] = value
+
+    # Only the paths that are expected to be submodules are listed unless
+    # there is no '.gitmodules', in which case the whole tree is scanned:
+    if has_gitmodules:
+        paths = sorted(set(names) | set(mapped_urls))
+        listing = (
+            repo.git.ls_tree("-z", commit.hexsha, "--", *paths) if paths else ""
+        )
+    else:
+        listing = repo.git.ls_tree("-r", "-z", commit.hexsha)
+
+    gitlinks = {}
+    for entry in listing.split("\0"):
+        if entry.startswith("160000 "):
+            meta, path = entry.split("\t", 1)
+            gitlinks[path] = meta.split()[2]
+
+    unknown_paths = set(mapped_urls) - set(gitlinks)
+    if unknown_paths:
+        raise GHCLAssertionError(
+            "no submodules at paths {0} in commit {1}".format(
+                ", ".join("'{0}'".format(p) for p in sorted(unknown_paths)),
+                commit.hexsha[:8],
+            )
+        )
+
+    if not gitlinks:
+        return []
+
+    remote_hosts = [url_host(url) for url in remote_urls]
+
+    submodules = []
+    for path, sha in sorted(gitlinks.items()):
+        name = names.get(path, path)
+
+        if path in mapped_urls:
+            urls_for_path = mapped_urls[path]
+        elif name in urls:
+            urls_for_path = [urls[name]]
+        else:
+            raise GHCLAssertionError(
+                "URL of submodule '{0}' is not found in '.gitmodules' of "
+                "commit {1}".format(path, commit.hexsha[:8])
+            )
+
+        targets = []
+        for url in urls_for_path:
+            if url.startswith(("./", "../")):
+                targets.extend(
+                    (resolve_submodule_url(remote_url, url), index)
+                    for index, remote_url in enumerate(remote_urls)
+                )
+            else:
+                # Use the credentials of the superproject remote repository on
+                # the same host, if any:
+                host = url_host(url)
+                index = (
+                    remote_hosts.index(host)
+                    if host is not None and host in remote_hosts
+                    else None
+                )
+                targets.append((url, index))
+
+        # The submodule repository is either checked out in the working tree
+        # or only initialized in the superproject repository:
+        candidates = [os.path.join(repo.git_dir, "modules", name)]
+        if repo.working_tree_dir:
+            candidates.insert(0, os.path.join(repo.working_tree_dir, path))
+        submodule_repo = None
+        for candidate in candidates:
+            try:
+                submodule_repo = Repo(candidate)
+                break
+            except (InvalidGitRepositoryError, NoSuchPathError):
+                pass
+
+        if submodule_repo is None or read_commit(submodule_repo, sha) is None:
+            raise GHCLAssertionError(
+                "commit {0} of submodule '{1}' is not found in the local "
+                "repository".format(sha[:8], path)
+            )
+
+        submodules.append((path, sha, submodule_repo, targets))
+
+    return submodules
+
+
+def push_submodules(submodules, credentials, args):
+    # Pushes the commits of the submodules to their remote repositories
+    # concurrently as dedicated tags, which are named after the commits and,
+    # therefore, never need to be moved, skipping the remote repositories that
+    # already have the tag, and exits if any of the pushes fails. The tags
+    # keep the commits from being garbage-collected in the remote repositories
+    # without touching the references of the superproject:
+    from git.exc import GitCommandError
+
+    pushes = [
+        (path, sha, submodule_repo, url)
+        for path, sha, submodule_repo, targets in submodules
+        for url, _ in targets
+    ]
+    if not pushes:
+        return
+
+    def push(path, sha, submodule_repo, url):
+        label = "[{0}: {1}] ".format(path, display_url(url))
+        ref_name = args.submodule_ref_prefix + sha
+        remote_commit = remote_ref_commit(submodule_repo, url, TAG, ref_name)
+        if remote_commit == sha:
+            info(
+                "{0}Tag '{1}' already points to {2} in the remote "
+                "repository".format(label, ref_name, sha[:8])
+            )
+            return True
+        try:
+            with metrics_span("submodule.push"):
+                submodule_repo.git.push(
+                    "--porcelain",
+                    "--",
+                    url,
+                    "{0}:{1}".format(sha, full_ref_name(TAG, ref_name)),
+                )
+        except GitCommandError as e:
+            warn(
+                "{0}Failed to push commit {1} to the remote repository: "
+                "{2}".format(label, sha[:8], e)
+            )
+            return False
+        info(
+            "{0}Commit {1} is successfully pushed to the remote repository "
+            "as tag '{2}'".format(label, sha[:8], ref_name)
+        )
+        return True
+
+    with ExitStack() as stack:
+        # Credentials for the remote repositories of each submodule:
+        for _, _, submodule_repo, targets in submodules:
+            sections = {}
+            for url, index in targets:
+                if index is not None:
+                    section, options = credential_config(
+                        url, *credentials[index]
+                    )
+                    sections[section] = options
+            if sections:
+                stack.enter_context(
+                    git_config(submodule_repo, {"repository": sections})
+                )
+
+        with ThreadPoolExecutor(max_workers=len(pushes)) as executor:
+            results = list(executor.map(lambda p: push(*p), pushes))
+
+    if not all(results):
+        exit(1)
+
+
+def default_ref_message(args):
+    if not args.ref_message and args.ref_signing_format != SIGNING_FORMAT_NONE:
+        return "signed"
+    return args.ref_message
+
+
+def create_ref_via_api(project, commit, ref_name, args):
+    # Creates the reference with the GitLab API and returns True if the commit
+    # already exists in the GitLab repository. Returns False if the commit is
+    # not found or the reference could not be created, in which case the
+    # reference needs to be pushed:
+    from gitlab.exceptions import GitlabCreateError
+
+    ref_title = "{0}{1} '{2}'".format(
+        args.ref_type[0].upper(), args.ref_type[1:], ref_name
+    )
+
+    if not gitlab_commit_exists(project, commit.hexsha):
+        info(
+            "Commit {0} is not found in the GitLab repository".format(
+                commit.hexsha[:8]
+            )
+        )
+        return False
+
+    try:
+        gitlab_create_ref(
+            project,
+            args.ref_type,
+            ref_name,
+            commit.hexsha,
+            default_ref_message(args),
+        )
+    except GitlabCreateError as e:
+        info(
+            "Failed to create {0} {1} with the GitLab API: {2}".format(
+                args.ref_type, ref_name, e
+            )
+        )
+        return False
+
+    info("{0} is successfully created with the GitLab API".format(ref_title))
+    return True
+
+
+def push_ref(repo, executor, commit, ref_name, remotes, args):
+    # Pushes the reference created for the commit to the remote repositories
+    # concurrently and returns the number of failed pushes.
+    from git import RemoteProgress
+
+    ref_message = default_ref_message(args)
+
+    ref_signing_key = args.ref_signing_key or os.environ.get(
+        "GCHL_REF_SIGNING_KEY", None
+    )
+    if ref_signing_key:
+        ref_signing_key = base64.b64decode(ref_signing_key)
+
+    ref_title = "{0}{1} '{2}'".format(
+        args.ref_type[0].upper(), args.ref_type[1:], ref_name
+    )
+
+    with ExitStack() as stack:
+        stack.enter_context(git_keep_head(repo))
+        stack.enter_context(
+            git_ref_exists_and_unique(
+                repo,
+                args.ref_type,
+                ref_name,
+                commit,
+                ref_message=ref_message,
+                ref_signing_format=args.ref_signing_format,
+                ref_signing_key=ref_signing_key,
+            )
+        )
+        remotes = [
+            (stack.enter_context(git_remote(repo, remote_url)), label)
+            for remote_url, label in remotes
+        ]
+
+        class Progress(RemoteProgress):
+            def __init__(self, label):
+                super().__init__()
+                self.label = label
+
+            def update(self, op_code, cur_count, max_count=None, message=""):
+                progress(
+                    (self.label, op_code & self.OP_MASK),
+                    self.label + self._cur_line,
+                    final=op_code & self.END,
+                )
+                if op_code == self.WRITING | self.END:
+                    metrics_count("push.objects", int(cur_count))
+                    size = parse_size(message)
+                    if size is not None:
+                        metrics_count("push.bytes", size)
+
+        def push(remote, label):
+            info(
+                "{0}Pushing {1} '{2}' to the remote repository:".format(
+                    label, args.ref_type, ref_name
+                )
+            )
+            try:
+                with metrics_span("push"):
+                    remote.push(
+                        ref_name,
+                        force=args.force_push,
+                        push_option=args.push_option or [],
+                        progress=Progress(label),
+                    ).raise_if_error()
+            except Exception as e:
+                warn(
+                    "{0}Failed to push {1} '{2}' to the remote repository: "
+                    "{3}".format(label, args.ref_type, ref_name, e)
+                )
+                return False
+            info(
+                "{0}{1} is successfully pushed to the remote "
+                "repository".format(label, ref_title)
+            )
+            return True
+
+        results = executor.map(lambda r: push(*r), remotes)
+        return sum(not result for result in results)
+
+
+def latest_ref_pipeline(project, commit, ref_name):
+    # Returns the latest pipeline for the commit and the reference or None if
+    # there is no such pipeline:
+    pipelines = project.pipelines.list(
+        sha=commit.hexsha,
+        ref=ref_name,
+        order_by="id",
+        sort="desc",
+        per_page=1,
+        get_all=False,
+    )
+    return pipelines[0] if pipelines else None
+
+
+def find_ref_pipeline(project, commit, ref_name, last_id, args):
+    # Waits for the pipeline that GitLab creates for the pushed reference and
+    # returns it. Only the pipelines with the ID greater than last_id, i.e. the
+    # ones created after the push, are accepted unless last_id is None:
+    poll_timeout = 0 if args.poll_timeout < 0 else args.poll_timeout
+    deadline = time.monotonic() + max(args.pipeline_timeout, 0)
+
+    while True:
+        pipeline = latest_ref_pipeline(project, commit, ref_name)
+        if pipeline and (last_id is None or pipeline.get_id() > last_id):
+            return pipeline
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise GHCLAssertionError(
+                "no {0}pipeline is found for '{1}' (SHA: {2})".format(
+                    "" if last_id is None else "new ",
+                    ref_name,
+                    commit.hexsha[:8],
+                )
+            )
+        # Do not flood the server with requests while waiting:
+        poll_sleep(min(max(poll_timeout, 1), remaining))
+
+
+def push_all(repo, commit, ref_name, remote_urls, args):
+    # Pushes the reference to the remote repositories, in which it does not
+    # point to the commit yet, and exits if any of the pushes fails. Returns
+    # True if the reference is pushed to at least one remote repository:
+    ref_title = "{0}{1} '{2}'".format(
+        args.ref_type[0].upper(), args.ref_type[1:], ref_name
+    )
+
+    # Labels of the remote repositories in the messages:
+    if len(remote_urls) > 1:
+        labels = ["[{0}] ".format(display_url(url)) for url in remote_urls]
+    else:
+        labels = [""]
+
+    with ThreadPoolExecutor(max_workers=len(remote_urls)) as executor:
+        # Skip the push to the remote repositories, in which the
+        # reference already points (or, in the case of a tag, peels)
+        # to the commit:
+        pending = []
+        for remote_url, label, remote_commit in zip(
+            remote_urls,
+            labels,
+            executor.map(
+                lambda url: remote_ref_commit(
+                    repo, url, args.ref_type, ref_name
+                ),
+                remote_urls,
+            ),
+        ):
+            if remote_commit == commit.hexsha:
+                info(
+                    "{0}{1} already points to {2} "
+                    "in the remote repository".format(
+                        label, ref_title, commit.hexsha[:8]
+                    )
+                )
+            else:
+                pending.append((remote_url, label))
+
+        if pending:
+            failed = push_ref(repo, executor, commit, ref_name, pending, args)
+            if failed:
+                exit(1)
+
+        return bool(pending)
+
+
 def cmd(args):
     # Local import of a non-standard package, which makes it possible to get the
     # help message even if the package is not available:
-    from git import RemoteProgress, Repo
+    from git import Repo
 
-    # Name for the credential section in the git configuration:
-    credential_section_name = 'credential "{0}"'.format(args.remote_url)
+    remote_urls = args.remote_url
 
-    # Required modifications of the git configuration:
-    required_config = {
-        "repository": {credential_section_name: {"username": args.username}}
-    }
+    find_pipeline = args.find_pipeline or args.attach
+    if find_pipeline and "ci.skip" in (args.push_option or []):
+        warn("No pipeline is expected for push option 'ci.skip'")
+        find_pipeline = False
 
-    # Default environment variable with the password to the remote repository:
-    password_variable = "GCHL_PASSWORD"
-
-    # If the password is provided, generate a temporary environment variable
-    # name:
-    if args.password is not None:
-        password_variable = "{0}{1}".format(
-            # The first symbol must be a letter:
-            random.choice(string.ascii_lowercase),
-            # The rest is a UUID without the hyphens:
-            uuid.uuid4().hex[1:],
+    if args.gitlab_create_ref and len(remote_urls) != 1:
+        raise GHCLAssertionError(
+            "the reference can be created with the GitLab API for a single "
+            "remote URL only"
         )
-    required_config["repository"][credential_section_name]["helper"] = (
-        '"!f() {{'
-        ' test \\"${{1}}\\" = get && echo \\"password=${{{0}}}\\"; '
-        '}}; f"'.format(password_variable)
+
+    gitlab_project = None
+    if args.gitlab_create_ref or find_pipeline:
+        if not (args.gitlab_server_url and args.gitlab_project_name):
+            raise GHCLAssertionError(
+                "the GitLab server URL and project name are required to create "
+                "the reference with the GitLab API or to find the pipeline"
+            )
+        gitlab_project = gitlab_server(
+            args.gitlab_server_url,
+            private_token=args.gitlab_token
+            or os.environ.get("GCHL_GITLAB_TOKEN", None),
+        ).projects.get(args.gitlab_project_name, lazy=True)
+
+    # Push options, forced updates and signed tags are not supported by the
+    # GitLab API:
+    use_gitlab_api = (
+        args.gitlab_create_ref
+        and not args.force_push
+        and not args.push_option
+        and args.ref_signing_format == SIGNING_FORMAT_NONE
     )
 
+    usernames = per_remote(args.username or ["token"], remote_urls, "username")
+    passwords = per_remote(args.password, remote_urls, "password")
+
+    # Paths of the submodules mapped to the lists of their remote URLs:
+    submodule_remote_urls = {}
+    for mapping in args.submodule_remote_url or []:
+        path, sep, url = mapping.partition("=")
+        if not sep or not path or not url:
+            raise GHCLAssertionError(
+                "unexpected format of the submodule remote URL '{0}': "
+                "PATH=URL is expected".format(display_url(mapping))
+            )
+        submodule_remote_urls.setdefault(path.strip("/"), []).append(url)
+
+    # Required modifications of the git configuration:
+    required_config = {"repository": {}}
+
+    # Environment variables with the passwords to the remote repositories:
+    password_variables = {}
+
+    # Usernames and names of the password variables for each remote URL:
+    credentials = []
+
+    for remote_url, username, password in zip(
+        remote_urls, usernames, passwords
+    ):
+        # Default environment variable with the password to the remote
+        # repository:
+        password_variable = "GCHL_PASSWORD"
+
+        # If the password is provided, generate a temporary environment
+        # variable name:
+        if password is not None:
+            password_variable = "{0}{1}".format(
+                # The first symbol must be a letter:
+                random.choice(string.ascii_lowercase),
+                # The rest is a UUID without the hyphens:
+                uuid.uuid4().hex[1:],
+            )
+            password_variables[password_variable] = password
+
+        credentials.append((username, password_variable))
+
+        section, options = credential_config(
+            remote_url, username, password_variable
+        )
+        required_config["repository"][section] = options
+
     # Annotated and signed tags require the committer information:
     name_needed = args.ref_type == TAG and (
         args.ref_message or args.ref_signing_format != SIGNING_FORMAT_NONE
@@ -165,9 +1069,10 @@ def cmd(args):
     repo = Repo.init(args.local_path, mkdir=False)
 
     with git_config(repo, required_config):
-        commit = repo.commit(args.rev_id)
+        os.environ.update(password_variables)
+        try:
+            commit = repo.commit(args.rev_id)
 
-        with git_keep_head(repo):
             ref_name = args.ref_name
             if not ref_name:
                 ref_name = "gchl-{0}-{1}".format(
@@ -181,80 +1086,113 @@ def cmd(args):
                 )
                 if rev_signing_key:
                     rev_signing_key = base64.b64decode(rev_signing_key)
-                with git_signing(repo, rev_signing_format, rev_signing_key):
-                    repo.head.reference = commit
-                    # TODO: handle erroneous zero exit code from git, which
-                    #  happens when ssh-keygen is unable to find the key
-                    repo.git.commit(amend=True, no_edit=True, gpg_sign=True)
-                    commit = repo.head.commit
-
-            ref_message = args.ref_message
-            if (
-                not ref_message
-                and args.ref_signing_format != SIGNING_FORMAT_NONE
-            ):
-                ref_message = "signed"
 
-            ref_signing_key = args.ref_signing_key or os.environ.get(
-                "GCHL_REF_SIGNING_KEY", None
-            )
-            if ref_signing_key:
-                ref_signing_key = base64.b64decode(ref_signing_key)
+                if args.rev_signing_base:
+                    commits = repo.git.rev_list(
+                        "--reverse",
+                        "--topo-order",
+                        "{0}..{1}".format(
+                            repo.commit(args.rev_signing_base).hexsha,
+                            commit.hexsha,
+                        ),
+                    ).split()
+                    if not commits:
+                        raise GHCLAssertionError(
+                            "no commits to sign: '{0}' is reachable from "
+                            "'{1}'".format(args.rev_id, args.rev_signing_base)
+                        )
+                else:
+                    commits = [commit.hexsha]
 
-            with git_ref_exists_and_unique(
-                repo,
-                args.ref_type,
-                ref_name,
-                commit,
-                ref_message=ref_message,
-                ref_signing_format=args.ref_signing_format,
-                ref_signing_key=ref_signing_key,
+                cached = None
+                if args.rev_signing_cache:
+                    fingerprint = signing_fingerprint(
+                        rev_signing_format, rev_signing_key
+                    )
+                    cached, contents, tip = read_signing_cache(
+                        repo, commits, fingerprint
+                    )
+
+                with git_signing(
+                    repo, rev_signing_format, rev_signing_key
+                ), metrics_span("rev.sign"):
+                    signed = sign_commits(repo, commits, cached)
+
+                if cached is not None:
+                    reused = sum(
+                        cached.get(c, None) == signed[c] for c in commits
+                    )
+                    metrics_count("rev.reused_commits", reused)
+                    metrics_count("rev.signed_commits", len(signed) - reused)
+                    write_signing_cache(
+                        repo,
+                        signed,
+                        signed[commit.hexsha],
+                        cached,
+                        contents,
+                        tip,
+                        fingerprint,
+                    )
+                else:
+                    metrics_count("rev.signed_commits", len(signed))
+
+                commit = repo.commit(signed[commit.hexsha])
+
+            # The pipeline that might already exist for the commit and the
+            # reference must not be mistaken for the one created by the push:
+            last_pipeline = None
+            if find_pipeline:
+                last_pipeline = latest_ref_pipeline(
+                    gitlab_project, commit, ref_name
+                )
+
+            # The commits of the submodules must be available in the remote
+            # repositories before the superproject:
+            if args.recurse_submodules:
+                submodules = find_submodules(
+                    repo, commit, remote_urls, submodule_remote_urls
+                )
+                push_submodules(submodules, credentials, args)
+
+            # The GitLab API does not require any git transfer if the commit
+            # is already in the GitLab repository:
+            pushed = True
+            if not (
+                use_gitlab_api
+                and create_ref_via_api(gitlab_project, commit, ref_name, args)
             ):
-                with git_remote(repo, args.remote_url) as remote:
-                    if args.password is not None:
-                        os.environ[password_variable] = args.password
-                    try:
-
-                        class Progress(RemoteProgress):
-                            def update(
-                                self,
-                                op_code,
-                                cur_count,
-                                max_count=None,
-                                message="",
-                            ):
-                                info(self._cur_line)
-
-                        info(
-                            "Pushing {0} '{1}' "
-                            "to the remote repository:".format(
-                                args.ref_type, ref_name
-                            )
-                        )
+                pushed = push_all(repo, commit, ref_name, remote_urls, args)
 
-                        remote.push(
-                            ref_name, force=args.force_push, progress=Progress()
-                        ).raise_if_error()
-
-                        info(
-                            "{0}{1} '{2}' is successfully pushed "
-                            "to the remote repository".format(
-                                args.ref_type[0].upper(),
-                                args.ref_type[1:],
-                                ref_name,
-                            )
-                        )
+            # No new pipeline is expected if the reference already points to
+            # the commit in all remote repositories:
+            if not pushed:
+                last_pipeline = None
+
+            write_outputs(args.ref_type, ref_name, commit)
+        finally:
+            for password_variable in password_variables:
+                os.environ.pop(password_variable, None)
+
+    if find_pipeline:
+        pipeline = find_ref_pipeline(
+            gitlab_project,
+            commit,
+            ref_name,
+            last_pipeline.get_id() if last_pipeline else None,
+            args,
+        )
+        gitlab_report_pipeline(pipeline)
+
+        # TODO: make it more generic
+        if "GITHUB_OUTPUT" in os.environ:
+            with open(os.environ["GITHUB_OUTPUT"], "a") as f:
+                f.writelines(
+                    [
+                        "pipeline-id={0}\n".format(pipeline.get_id()),
+                        "pipeline-sha={0}\n".format(pipeline.sha),
+                    ]
+                )
 
-                        # TODO: make it more generic
-                        if "GITHUB_OUTPUT" in os.environ:
-                            with open(os.environ["GITHUB_OUTPUT"], "a") as f:
-                                f.writelines(
-                                    [
-                                        "ref-type={0}\n".format(args.ref_type),
-                                        "ref-name={0}\n".format(ref_name),
-                                        "ref-commit={0}\n".format(commit),
-                                    ]
-                                )
-                    finally:
-                        if args.password is not None:
-                            os.environ.pop(password_variable, None)
+        if args.attach:
+            gitlab_attach_pipeline(pipeline, args.poll_timeout)
+            exit(pipeline.status != PIPELINE_SUCCESS)
@@ -1,12 +1,23 @@
-import sys
-import time
+import codecs
+import json
+import os
+import tempfile
+from collections import deque
 
 from common import (
     JOB_FINAL_STATUSES,
     JOB_SUCCESS,
     PIPELINE_FINAL_STATUSES,
     GHCLAssertionError,
+    GitlabJobIndex,
+    gitlab_report_pipeline,
+    gitlab_server,
     info,
+    metrics_count,
+    output,
+    output_flush,
+    poll_sleep,
+    warn,
 )
 
 description = (
@@ -32,53 +43,136 @@ def setup_parser(parser):
         default=10,
         help="job status poll timeout in seconds (default: '%(default)s')",
     )
+    parser.add_argument(
+        "--state-file",
+        help="JSON file to keep the IDs of the job and its project and the "
+        "size of its reported trace in: if the file exists, the job is not "
+        "looked up by name and its trace is reported starting from where the "
+        "previous run stopped",
+    )
+    parser.add_argument(
+        "--tail",
+        type=int,
+        metavar="N",
+        help="report only the last N lines of the trace available when "
+        "attaching to the job (ignored if the trace is reported partially "
+        "according to STATE_FILE)",
+    )
 
 
-def cmd(args):
-    # Local import of a non-standard package, which makes it possible to get the
-    # help message even if the package is not available:
-    import gitlab
+# Size of the trace chunks to download:
+TRACE_CHUNK_SIZE = 1 << 16
+
+
+def read_state(state_file):
+    # Returns the state saved in the file or an empty state if the file does not
+    # exist or cannot be parsed:
+    try:
+        with open(state_file) as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except ValueError as e:
+        warn("Failed to read state file '{0}': {1}".format(state_file, e))
+        return {}
+    return state if isinstance(state, dict) else {}
 
-    server = gitlab.Gitlab(
-        url=args.server_url,
-        private_token=args.token,
-    )
+
+def write_state(state_file, job_key, project_id, job_id, trace_offset):
+    # Records the ID of the job, the ID of the project it belongs to (which
+    # differs from the requested one for the jobs of multi-project downstream
+    # pipelines) and the size of its reported trace in bytes in the file,
+    # keeping the entries of other jobs. The file is replaced atomically, so an
+    # interrupted run never leaves a broken file behind:
+    state = read_state(state_file)
+    state.setdefault("jobs", {})[job_key] = job_id
+    state.setdefault("projects", {})[str(job_id)] = project_id
+    state.setdefault("offsets", {})[str(job_id)] = trace_offset
+    with tempfile.NamedTemporaryFile(
+        "w",
+        dir=os.path.dirname(os.path.abspath(state_file)),
+        prefix=".gchl-",
+        delete=False,
+    ) as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+        f.write("\n")
+    os.replace(f.name, state_file)
+
+
+def trace_tail(chunks, lines_number):
+    # Returns the last lines of the trace and the size of the trace in bytes:
+    lines = deque(maxlen=lines_number)
+    line = bytearray()
+    size = 0
+    for chunk in chunks:
+        size += len(chunk)
+        start = 0
+        while True:
+            end = chunk.find(b"\n", start)
+            if end < 0:
+                line.extend(chunk[start:])
+                break
+            line.extend(chunk[start : end + 1])
+            lines.append(bytes(line))
+            line.clear()
+            start = end + 1
+    if line:
+        lines.append(bytes(line))
+    return b"".join(lines), size
+
+
+def cmd(args):
+    server = gitlab_server(args.server_url, private_token=args.token)
 
     project = server.projects.get(args.project_name, lazy=True)
     pipeline = project.pipelines.get(args.pipeline_id, lazy=True)
 
     requested_job = None
+    # Project the requested job belongs to:
+    job_project = project
+    # Size of the reported part of the trace in bytes:
     reported_trace_len = 0
 
+    job_key = "{0}:{1}".format(args.pipeline_id, args.job_name)
+    if args.state_file:
+        state = read_state(args.state_file)
+        job_id = state.get("jobs", {}).get(job_key, None)
+        if job_id is not None:
+            project_id = state.get("projects", {}).get(str(job_id), None)
+            if project_id is not None:
+                job_project = server.projects.get(project_id, lazy=True)
+            requested_job = job_project.jobs.get(job_id, lazy=True)
+            reported_trace_len = state.get("offsets", {}).get(str(job_id), 0)
+
+    # The trace is decoded incrementally, so that multibyte characters split
+    # between the chunks are decoded correctly:
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    # Jobs of the pipeline and its downstream pipelines by name, which is
+    # updated incrementally until the requested job is found:
+    job_index = GitlabJobIndex(project, args.pipeline_id)
+
+    tail = args.tail if not reported_trace_len else None
+    report_status = True
+
     poll_timeout = 0 if args.poll_timeout < 0 else args.poll_timeout
 
     while True:
         if requested_job is None:
             pipeline.refresh()
-            info(
-                "Pipeline for '{0}' (SHA: {1}): {2} ({3})".format(
-                    pipeline.ref,
-                    pipeline.sha[:8],
-                    pipeline.status,
-                    pipeline.web_url,
-                )
-            )
-            for job in pipeline.jobs.list():
-                if job.name == args.job_name:
-                    if requested_job is None:
-                        requested_job = project.jobs.get(job.id, lazy=True)
-                    else:
-                        raise GHCLAssertionError(
-                            "ambiguous job name: more than one job in the "
-                            "pipeline has name '{0}'".format(args.job_name)
-                        )
+            gitlab_report_pipeline(pipeline)
+            job_index.update()
+            found = job_index.find(args.job_name)
+            if found is not None:
+                job_project, job = found
+                requested_job = job_project.jobs.get(job.id, lazy=True)
 
         if requested_job is None:
             if pipeline.status in PIPELINE_FINAL_STATUSES:
                 break
         else:
             requested_job.refresh()
-            if not reported_trace_len:
+            if report_status:
                 info(
                     "\tjob '{0}': {1} ({2})".format(
                         requested_job.name,
@@ -86,20 +180,57 @@ def cmd(args):
                         requested_job.web_url,
                     )
                 )
-            poll_trace_len = 0
-            for chunk in requested_job.trace(streamed=True, iterator=True):
-                chunk = chunk.decode()
-                chunk_len = len(chunk)
-                unreported_subchunk_start = reported_trace_len - poll_trace_len
-                poll_trace_len += chunk_len
-                if chunk_len > unreported_subchunk_start:
-                    print(
-                        chunk[unreported_subchunk_start:],
-                        end="",
-                        file=sys.stdout,
+                if reported_trace_len:
+                    info(
+                        "\t... resuming the trace after {0} bytes".format(
+                            reported_trace_len
+                        )
                     )
-                    reported_trace_len = poll_trace_len
-            sys.stdout.flush()
+            chunks = requested_job.trace(
+                streamed=True, iterator=True, chunk_size=TRACE_CHUNK_SIZE
+            )
+            if tail is not None:
+                text, trace_len = trace_tail(chunks, max(tail, 0))
+                metrics_count("trace.bytes", trace_len)
+                if trace_len > len(text):
+                    info(
+                        "\t... skipping {0} bytes of the trace".format(
+                            trace_len - len(text)
+                        )
+                    )
+                output(decoder.decode(text))
+                reported_trace_len = trace_len
+                tail = None
+            else:
+                poll_trace_len = 0
+                for chunk in chunks:
+                    metrics_count("trace.bytes", len(chunk))
+                    chunk_start = poll_trace_len
+                    poll_trace_len += len(chunk)
+                    if poll_trace_len > reported_trace_len:
+                        output(
+                            decoder.decode(
+                                chunk[
+                                    max(reported_trace_len - chunk_start, 0) :
+                                ]
+                            )
+                        )
+                        reported_trace_len = poll_trace_len
+            # Keep reporting the status until the trace appears:
+            report_status = not reported_trace_len
+
+            if args.state_file:
+                # Make sure that the recorded part of the trace is reported
+                # and exclude the incomplete character from it:
+                output_flush()
+                write_state(
+                    args.state_file,
+                    job_key,
+                    job_project.get_id(),
+                    requested_job.get_id(),
+                    reported_trace_len - len(decoder.getstate()[0]),
+                )
+
             if requested_job.status in JOB_FINAL_STATUSES:
                 if reported_trace_len:
                     info(
@@ -111,7 +242,7 @@ def cmd(args):
                     )
                 break
 
-        time.sleep(poll_timeout)
+        poll_sleep(poll_timeout)
 
     if requested_job is None:
         raise GHCLAssertionError(
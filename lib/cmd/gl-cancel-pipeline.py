@@ -1,4 +1,4 @@
-from common import info, warn
+from common import gitlab_server, info, warn
 
 description = "cancels a GitLab CI pipeline"
 
@@ -24,14 +24,7 @@ def setup_parser(parser):
 
 
 def cmd(args):
-    # Local import of a non-standard package, which makes it possible to get the
-    # help message even if the package is not available:
-    import gitlab
-
-    server = gitlab.Gitlab(
-        url=args.server_url,
-        private_token=args.token,
-    )
+    server = gitlab_server(args.server_url, private_token=args.token)
 
     project = server.projects.get(args.project_name, lazy=True)
     pipeline = project.pipelines.get(args.pipeline_id, lazy=True)
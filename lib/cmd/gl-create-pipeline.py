@@ -1,7 +1,16 @@
+import json
 import os
-import time
+from datetime import datetime
 
-from common import PIPELINE_FINAL_STATUSES, PIPELINE_SUCCESS, info, warn
+from common import (
+    PIPELINE_SUCCESS,
+    gitlab_attach_pipeline,
+    gitlab_pipeline_jobs,
+    gitlab_report_pipeline,
+    gitlab_server,
+    info,
+    warn,
+)
 
 description = "creates a GitLab CI pipeline"
 
@@ -36,28 +45,241 @@ def setup_parser(parser):
         default=10,
         help="pipeline status poll timeout in seconds (default: '%(default)s')",
     )
+    parser.add_argument(
+        "--report",
+        action="store_true",
+        help="report the critical path through the pipeline, the total time "
+        "the jobs were queued and the slowest jobs after the pipeline "
+        "finishes (ignored without --attach, default: '%(default)s')",
+    )
+    parser.add_argument(
+        "--report-file",
+        help="file to write the report in JSON format to (implies --report)",
+    )
+    parser.add_argument(
+        "--report-top",
+        type=int,
+        default=5,
+        help="number of the slowest jobs to report (default: '%(default)s')",
+    )
 
 
-def cmd(args):
-    # Local import of a non-standard package, which makes it possible to get the
-    # help message even if the package is not available:
-    import gitlab
+def parse_time(value):
+    # Returns the timestamp in seconds for the time in the ISO 8601 format
+    # used by GitLab (e.g. '2024-01-01T00:00:00.000Z') or None:
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
 
-    server = gitlab.Gitlab(
-        url=args.server_url,
-        private_token=args.token,
-    )
 
-    project = server.projects.get(args.project_name, lazy=True)
-    pipeline = project.pipelines.create({"ref": args.ref_name})
+def format_duration(seconds):
+    if seconds is None:
+        return "-"
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return "{0}h{1:02d}m{2:02d}s".format(hours, minutes, seconds)
+    if minutes:
+        return "{0}m{1:02d}s".format(minutes, seconds)
+    return "{0}s".format(seconds)
+
+
+def pipeline_report(pipeline, jobs, top):
+    # Returns the report on the finished pipeline as a dictionary. The jobs
+    # wait for the jobs they need if the 'needs' attribute is available and
+    # for all jobs of the previous stages otherwise. The stages are ordered by
+    # the lowest ID of their jobs, since GitLab creates the jobs in the order
+    # of the stages. The critical path is built backwards from the job that
+    # finished last by following the dependency that finished last before the
+    # job started. The time a job on the critical path waited is counted from
+    # the moment its dependency on the path finished (or the pipeline was
+    # created), since the jobs are not queued before their dependencies
+    # finish.
+    records = []
+    for job in jobs:
+        created = parse_time(job.attributes.get("created_at", None))
+        started = parse_time(job.attributes.get("started_at", None))
+        finished = parse_time(job.attributes.get("finished_at", None))
+        queued = job.attributes.get("queued_duration", None)
+        if queued is None and created is not None and started is not None:
+            queued = started - created
+        duration = job.attributes.get("duration", None)
+        if duration is None and started is not None and finished is not None:
+            duration = finished - started
+        records.append(
+            {
+                "id": job.id,
+                "name": job.name,
+                "stage": job.stage,
+                "status": job.status,
+                "created": created,
+                "started": started,
+                "finished": finished,
+                "queued": queued,
+                "duration": duration,
+                "needs": job.attributes.get("needs", None),
+                "web_url": job.web_url,
+            }
+        )
+
+    first_ids = {}
+    for record in records:
+        first_ids[record["stage"]] = min(
+            record["id"], first_ids.get(record["stage"], record["id"])
+        )
+    stages = sorted(first_ids, key=first_ids.get)
+    stage_index = {stage: index for index, stage in enumerate(stages)}
+
+    by_name = {record["name"]: record for record in records}
+
+    def dependencies(record):
+        if record["needs"] is not None:
+            names = [
+                need["name"] if isinstance(need, dict) else need
+                for need in record["needs"]
+            ]
+            return [by_name[name] for name in names if name in by_name]
+        return [
+            other
+            for other in records
+            if stage_index[other["stage"]] < stage_index[record["stage"]]
+        ]
+
+    finished = [r for r in records if r["finished"] is not None]
+    critical_path = []
+    if finished:
+        record = max(finished, key=lambda r: (r["finished"], r["id"]))
+        while record is not None:
+            critical_path.append(record)
+            start = record["started"] or record["finished"]
+            candidates = [
+                other
+                for other in dependencies(record)
+                if other["finished"] is not None and other["finished"] <= start
+            ]
+            record = (
+                max(candidates, key=lambda r: (r["finished"], r["id"]))
+                if candidates
+                else None
+            )
+        critical_path.reverse()
+
+    pipeline_start = parse_time(pipeline.attributes.get("created_at", None))
+    if pipeline_start is None:
+        created = [r["created"] for r in records if r["created"] is not None]
+        pipeline_start = min(created) if created else None
+
+    def job_summary(record):
+        return {
+            "name": record["name"],
+            "stage": record["stage"],
+            "status": record["status"],
+            "queued": record["queued"],
+            "duration": record["duration"],
+            "web_url": record["web_url"],
+        }
+
+    path_jobs = []
+    ready = pipeline_start
+    for record in critical_path:
+        summary = job_summary(record)
+        summary["waited"] = (
+            max(record["started"] - ready, 0.0)
+            if record["started"] is not None and ready is not None
+            else record["queued"]
+        )
+        path_jobs.append(summary)
+        ready = record["finished"]
+
+    queued = [r for r in records if r["queued"] is not None]
+    slowest = sorted(
+        (r for r in records if r["duration"] is not None),
+        key=lambda r: -r["duration"],
+    )[: max(top, 0)]
+
+    path_end = critical_path[-1]["finished"] if critical_path else None
+    return {
+        "pipeline": {
+            "id": pipeline.get_id(),
+            "status": pipeline.status,
+            "web_url": pipeline.web_url,
+            "duration": (
+                path_end - pipeline_start
+                if path_end is not None and pipeline_start is not None
+                else None
+            ),
+        },
+        "stages": stages,
+        "critical_path": {
+            "jobs": path_jobs,
+            "duration": sum(j["duration"] or 0 for j in path_jobs),
+            "waited": sum(j["waited"] or 0 for j in path_jobs),
+        },
+        "queued": {
+            "jobs": len(queued),
+            "total": sum(r["queued"] for r in queued),
+            "max": max((r["queued"] for r in queued), default=None),
+        },
+        "slowest_jobs": [job_summary(r) for r in slowest],
+    }
+
+
+def print_report(report):
+    def table(rows):
+        widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+        for row in rows:
+            info(
+                "\t"
+                + "  ".join(
+                    cell.ljust(width) for cell, width in zip(row, widths)
+                ).rstrip()
+            )
+
+    def job_rows(jobs, queued_key):
+        return [["stage", "job", "status", queued_key, "duration"]] + [
+            [
+                job["stage"],
+                job["name"],
+                job["status"],
+                format_duration(job[queued_key]),
+                format_duration(job["duration"]),
+            ]
+            for job in jobs
+        ]
+
+    info(
+        "Pipeline duration: {0}".format(
+            format_duration(report["pipeline"]["duration"])
+        )
+    )
+    critical_path = report["critical_path"]
     info(
-        "Pipeline for '{0}' (SHA: {1}): {2} ({3})".format(
-            pipeline.ref,
-            pipeline.sha[:8],
-            pipeline.status,
-            pipeline.web_url,
+        "Critical path: {0} jobs, {1} running, {2} waiting".format(
+            len(critical_path["jobs"]),
+            format_duration(critical_path["duration"]),
+            format_duration(critical_path["waited"]),
         )
     )
+    if critical_path["jobs"]:
+        table(job_rows(critical_path["jobs"], "waited"))
+    info(
+        "Queue wait: {0} in total for {1} jobs, {2} at most".format(
+            format_duration(report["queued"]["total"]),
+            report["queued"]["jobs"],
+            format_duration(report["queued"]["max"]),
+        )
+    )
+    if report["slowest_jobs"]:
+        info("Slowest jobs:")
+        table(job_rows(report["slowest_jobs"], "queued"))
+
+
+def cmd(args):
+    server = gitlab_server(args.server_url, private_token=args.token)
+
+    project = server.projects.get(args.project_name, lazy=True)
+    pipeline = project.pipelines.create({"ref": args.ref_name})
+    gitlab_report_pipeline(pipeline)
 
     # TODO: make it more generic
     if "GITHUB_OUTPUT" in os.environ:
@@ -79,25 +301,16 @@ def cmd(args):
         exit(1)
 
     if args.attach:
-        poll_timeout = 0 if args.poll_timeout < 0 else args.poll_timeout
-
-        while pipeline.status not in PIPELINE_FINAL_STATUSES:
-            time.sleep(poll_timeout)
-            pipeline.refresh()
-            for job in pipeline.jobs.list():
-                info(
-                    "\tjob '{0}': {1} ({2})".format(
-                        job.name, job.status, job.web_url
-                    )
-                )
-
-        info(
-            "Pipeline for '{0}' (SHA: {1}): {2} ({3})".format(
-                pipeline.ref,
-                pipeline.sha[:8],
-                pipeline.status,
-                pipeline.web_url,
+        gitlab_attach_pipeline(pipeline, args.poll_timeout)
+
+        if args.report or args.report_file:
+            report = pipeline_report(
+                pipeline, list(gitlab_pipeline_jobs(pipeline)), args.report_top
             )
-        )
+            print_report(report)
+            if args.report_file:
+                with open(args.report_file, "w") as f:
+                    json.dump(report, f, indent=2)
+                    f.write("\n")
 
         exit(pipeline.status != PIPELINE_SUCCESS)
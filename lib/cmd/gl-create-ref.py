@@ -0,0 +1,102 @@
+import os
+
+from common import (
+    BRANCH,
+    TAG,
+    GHCLAssertionError,
+    gitlab_commit_exists,
+    gitlab_create_ref,
+    gitlab_ref_manager,
+    gitlab_server,
+    info,
+)
+
+description = (
+    "creates a git reference in GitLab repository for an existing commit"
+)
+
+
+def setup_parser(parser):
+    parser.add_argument("--server-url", required=True, help="GitLab server URL")
+    parser.add_argument(
+        "--project-name", required=True, help="GitLab project name"
+    )
+    parser.add_argument("--token", required=True, help="GitLab access token")
+    ref_types = [TAG, BRANCH]
+    parser.add_argument(
+        "--ref-type",
+        metavar="REF_TYPE {{{0}}}".format(",".join(ref_types)),
+        choices=ref_types,
+        default=TAG,
+        help="type of the reference to create (default: '%(default)s')",
+    )
+    parser.add_argument(
+        "--ref-name",
+        required=True,
+        metavar="REF_NAME",
+        help="name of the reference to create",
+    )
+    parser.add_argument(
+        "--ref-commit",
+        required=True,
+        metavar="REF_COMMIT",
+        help="SHA-1 of the commit to create the reference for, which must "
+        "already exist in the GitLab repository",
+    )
+    parser.add_argument(
+        "--ref-message",
+        help="annotation message of the reference (ignored if REF_TYPE is not "
+        "'{0}')".format(TAG),
+    )
+
+
+def cmd(args):
+    server = gitlab_server(args.server_url, private_token=args.token)
+
+    project = server.projects.get(args.project_name, lazy=True)
+
+    ref_title = "{0}{1} '{2}'".format(
+        args.ref_type[0].upper(), args.ref_type[1:], args.ref_name
+    )
+
+    if not gitlab_commit_exists(project, args.ref_commit):
+        raise GHCLAssertionError(
+            "commit '{0}' is not found in the GitLab repository".format(
+                args.ref_commit
+            )
+        )
+
+    # Local import of a non-standard package, which makes it possible to get the
+    # help message even if the package is not available:
+    from gitlab.exceptions import GitlabCreateError, GitlabGetError
+
+    try:
+        ref = gitlab_create_ref(
+            project,
+            args.ref_type,
+            args.ref_name,
+            args.ref_commit,
+            args.ref_message,
+        )
+        info("{0} is successfully created".format(ref_title))
+    except GitlabCreateError:
+        # Make retries idempotent: the reference might have been created by a
+        # previous attempt:
+        try:
+            ref = gitlab_ref_manager(project, args.ref_type).get(args.ref_name)
+        except GitlabGetError:
+            ref = None
+        if ref is None or ref.commit["id"] != args.ref_commit:
+            raise
+        info("{0} already points to {1}".format(ref_title, args.ref_commit[:8]))
+
+    # TODO: make it more generic
+    if "GITHUB_OUTPUT" in os.environ:
+        with open(os.environ["GITHUB_OUTPUT"], "a") as f:
+            f.writelines(
+                [
+                    "ref-type={0}\n".format(args.ref_type),
+                    "ref-name={0}\n".format(ref.name),
+                    "ref-commit={0}\n".format(ref.commit["id"]),
+                ]
+            )
@@ -1,4 +1,11 @@
-from common import BRANCH, TAG, GHCLAssertionError, info, warn
+from common import (
+    BRANCH,
+    TAG,
+    gitlab_ref_manager,
+    gitlab_server,
+    info,
+    warn,
+)
 
 description = "deletes a git reference from GitLab repository"
 
@@ -32,25 +39,11 @@ def setup_parser(parser):
 
 
 def cmd(args):
-    # Local import of a non-standard package, which makes it possible to get the
-    # help message even if the package is not available:
-    import gitlab
-
-    server = gitlab.Gitlab(
-        url=args.server_url,
-        private_token=args.token,
-    )
+    server = gitlab_server(args.server_url, private_token=args.token)
 
     project = server.projects.get(args.project_name, lazy=True)
 
-    if args.ref_type == BRANCH:
-        ref_manager = project.branches
-    elif args.ref_type == TAG:
-        ref_manager = project.tags
-    else:
-        raise GHCLAssertionError(
-            "unexpected reference type {0}".format(args.ref_type)
-        )
+    ref_manager = gitlab_ref_manager(project, args.ref_type)
 
     try:
         ref_manager.delete(args.ref_name)
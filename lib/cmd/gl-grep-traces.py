@@ -0,0 +1,284 @@
+import fnmatch
+import json
+import os
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from common import (
+    GitlabJobIndex,
+    gitlab_report_pipeline,
+    gitlab_server,
+    info,
+    metrics_count,
+    metrics_span,
+    output,
+)
+
+description = "searches the traces of the GitLab CI pipeline jobs for a pattern"
+
+
+def setup_parser(parser):
+    parser.add_argument("--server-url", required=True, help="GitLab server URL")
+    parser.add_argument(
+        "--project-name", required=True, help="GitLab project name"
+    )
+    parser.add_argument("--token", required=True, help="GitLab access token")
+    parser.add_argument(
+        "--pipeline-id", required=True, help="ID of the pipeline"
+    )
+    parser.add_argument(
+        "--pattern",
+        required=True,
+        help="Python regular expression to search for in the job trace lines",
+    )
+    parser.add_argument(
+        "--ignore-case",
+        action="store_true",
+        help="ignore case distinctions in PATTERN (default: '%(default)s')",
+    )
+    parser.add_argument(
+        "--job-status",
+        action="append",
+        metavar="JOB_STATUS",
+        help="status of the jobs to search (e.g. 'failed', can be repeated, "
+        "default: all statuses); only the newest attempt of each job is "
+        "considered",
+    )
+    parser.add_argument(
+        "--job-name",
+        action="append",
+        metavar="JOB_NAME",
+        help="shell-style wildcard pattern for the names of the jobs to search "
+        "(can be repeated, default: all names)",
+    )
+    parser.add_argument(
+        "--context",
+        type=int,
+        default=0,
+        help="number of lines of context to report before and after each "
+        "matching line (default: '%(default)s')",
+    )
+    parser.add_argument(
+        "--max-count",
+        type=int,
+        help="stop reading the trace of a job after MAX_COUNT matching lines "
+        "(default: unlimited)",
+    )
+    parser.add_argument(
+        "--no-downstream",
+        action="store_true",
+        help="do not search the jobs of the downstream (child and "
+        "multi-project) pipelines (default: '%(default)s')",
+    )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=8,
+        help="maximum number of traces to fetch concurrently "
+        "(default: '%(default)s')",
+    )
+
+
+# Size of the trace chunks to download:
+TRACE_CHUNK_SIZE = 1 << 16
+
+# Terminal control sequences, which GitLab runners emit to colorize the trace
+# and to fold its sections:
+_ansi_regex = re.compile(r"\x1b\[[0-9;?]*[A-Za-z]")
+# Parts of the lines overwritten after carriage returns:
+_overwritten_regex = re.compile(r"^[^\n]*\r(?=[^\r\n])", re.MULTILINE)
+# Trailing carriage returns:
+_trailing_cr_regex = re.compile(r"\r+\n")
+
+
+def render(block):
+    # Returns the block of complete trace lines as they would be rendered in a
+    # terminal:
+    text = _ansi_regex.sub("", block.decode(errors="replace"))
+    if "\r" in text:
+        text = _overwritten_regex.sub("", text)
+        text = _trailing_cr_regex.sub("\n", text)
+    return text
+
+
+def trace_blocks(chunks):
+    # Splits the stream of trace chunks into rendered blocks of complete lines
+    # (each line ends with a newline) without reading the whole trace into
+    # memory:
+    pending = bytearray()
+    for chunk in chunks:
+        metrics_count("trace.bytes", len(chunk))
+        pending.extend(chunk)
+        end = pending.rfind(b"\n")
+        if end >= 0:
+            yield render(bytes(pending[: end + 1]))
+            del pending[: end + 1]
+    if pending:
+        yield render(bytes(pending) + b"\n")
+
+
+class TraceGrep(object):
+    # Searches the trace lines for the regular expression and collects the
+    # reported lines in the format of grep: the matching lines are prefixed
+    # with 'NAME:NUMBER:', the context lines are prefixed with 'NAME-NUMBER-',
+    # non-adjacent groups of lines are separated with '--'.
+
+    def __init__(self, job_name, regex, context, max_count):
+        self.job_name = job_name
+        self.regex = regex
+        self.context = context
+        self.max_count = max_count
+        self.reported = []
+        self.matches = 0
+        self.before = deque(maxlen=context)
+        self.after = 0
+        self.last_reported = 0
+        self.number = 0
+
+    def done(self):
+        return (
+            self.max_count is not None
+            and self.matches >= self.max_count
+            and not self.after
+        )
+
+    def report(self, number, line, separator):
+        if self.reported and number > self.last_reported + 1:
+            self.reported.append("--")
+        self.reported.append(
+            "{0}{1}{2}{1}{3}".format(self.job_name, separator, number, line)
+        )
+        self.last_reported = number
+
+    def line(self, line):
+        self.number += 1
+        if (
+            self.max_count is None or self.matches < self.max_count
+        ) and self.regex.search(line):
+            self.matches += 1
+            for before_number, before_line in self.before:
+                self.report(before_number, before_line, "-")
+            self.before.clear()
+            self.report(self.number, line, ":")
+            self.after = self.context
+        elif self.after:
+            self.report(self.number, line, "-")
+            self.after -= 1
+        elif self.context:
+            self.before.append((self.number, line))
+
+    def skip(self, text):
+        # Accounts for the complete lines that are known not to match:
+        count = text.count("\n")
+        if self.context and count:
+            lines = text[:-1].rsplit("\n", self.context)[-self.context :]
+            first = self.number + count - len(lines) + 1
+            self.before.extend(enumerate(lines, start=first))
+        self.number += count
+
+    def block(self, block):
+        # Processes the block of complete lines. Only the lines that might
+        # match and the context lines are processed one by one, the rest of
+        # the block is skipped by the regular expression engine.
+        pos = 0
+        while pos < len(block) and not self.done():
+            if not self.after:
+                match = self.regex.search(block, pos)
+                if match is None:
+                    self.skip(block[pos:])
+                    return
+                # The line that contains the beginning of the match:
+                start = block.rfind("\n", pos, match.start()) + 1
+                if start > pos:
+                    self.skip(block[pos:start])
+                    pos = start
+            end = block.index("\n", pos)
+            self.line(block[pos:end])
+            pos = end + 1
+
+
+def grep_trace(job, job_name, regex, context, max_count):
+    # Returns the reported lines and the number of the matching lines:
+    grep = TraceGrep(job_name, regex, context, max_count)
+    chunks = job.trace(
+        streamed=True, iterator=True, chunk_size=TRACE_CHUNK_SIZE
+    )
+    for block in trace_blocks(chunks):
+        grep.block(block)
+        if grep.done():
+            # The rest of the trace is not needed:
+            break
+    return grep.reported, grep.matches
+
+
+def cmd(args):
+    server = gitlab_server(args.server_url, private_token=args.token)
+
+    project = server.projects.get(args.project_name, lazy=True)
+    pipeline = project.pipelines.get(args.pipeline_id)
+    gitlab_report_pipeline(pipeline)
+
+    # The lines are searched in blocks, in which '^' and '$' must match at the
+    # line boundaries:
+    regex = re.compile(
+        args.pattern,
+        re.MULTILINE | (re.IGNORECASE if args.ignore_case else 0),
+    )
+    context = max(args.context, 0)
+
+    job_index = GitlabJobIndex(
+        project, args.pipeline_id, downstream=not args.no_downstream
+    )
+    job_index.update()
+    jobs = [
+        (job_project, job)
+        for job_project, job in job_index.jobs()
+        if (not args.job_status or job.status in args.job_status)
+        and (
+            not args.job_name
+            or any(fnmatch.fnmatchcase(job.name, p) for p in args.job_name)
+        )
+    ]
+    info("Searching traces of {0} jobs".format(len(jobs)))
+
+    def search(entry):
+        job_project, job = entry
+        with metrics_span("trace.search"):
+            return grep_trace(
+                job_project.jobs.get(job.id, lazy=True),
+                job.name,
+                regex,
+                context,
+                args.max_count,
+            )
+
+    matched_jobs = []
+    with ThreadPoolExecutor(max_workers=max(args.max_workers, 1)) as executor:
+        # The results are reported in the order of the jobs, each of them as
+        # a single block as soon as the results for the preceding jobs are
+        # reported:
+        for (_, job), (reported, matches) in zip(
+            jobs, executor.map(search, jobs)
+        ):
+            if matches:
+                matched_jobs.append(job.name)
+                info(
+                    "\tjob '{0}': {1}, {2} matching lines ({3})".format(
+                        job.name, job.status, matches, job.web_url
+                    )
+                )
+                output("".join(line + "\n" for line in reported))
+
+    info(
+        "Pattern is found in the traces of {0} out of {1} jobs".format(
+            len(matched_jobs), len(jobs)
+        )
+    )
+
+    # TODO: make it more generic
+    if "GITHUB_OUTPUT" in os.environ:
+        with open(os.environ["GITHUB_OUTPUT"], "a") as f:
+            f.write("matched-jobs={0}\n".format(json.dumps(matched_jobs)))
+
+    exit(not matched_jobs)
@@ -1,6 +1,6 @@
 import os
 
-from common import info, warn
+from common import gitlab_report_pipeline, gitlab_server, warn
 
 description = "triggers a GitLab CI pipeline"
 
@@ -28,22 +28,11 @@ def setup_parser(parser):
 
 
 def cmd(args):
-    # Local import of a non-standard package, which makes it possible to get the
-    # help message even if the package is not available:
-    import gitlab
-
-    server = gitlab.Gitlab(url=args.server_url)
+    server = gitlab_server(args.server_url)
 
     project = server.projects.get(args.project_name, lazy=True)
     pipeline = project.trigger_pipeline(args.ref_name, args.token)
-    info(
-        "Pipeline for '{0}' (SHA: {1}): {2} ({3})".format(
-            pipeline.ref,
-            pipeline.sha[:8],
-            pipeline.status,
-            pipeline.web_url,
-        )
-    )
+    gitlab_report_pipeline(pipeline)
 
     # TODO: make it more generic
     if "GITHUB_OUTPUT" in os.environ:
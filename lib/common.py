@@ -1,5 +1,10 @@
+import json
+import os
+import re
 import sys
 import tempfile
+import threading
+import time
 import uuid
 from contextlib import contextmanager
 
@@ -20,14 +25,549 @@ class GHCLAssertionError(AssertionError):
     pass
 
 
+class _BufferedOutput(object):
+    # Buffers the text written to the stream and flushes it when the buffer
+    # grows over MAX_SIZE characters or when its oldest part has been waiting
+    # for MAX_DELAY seconds, which replaces a lot of small writes (and
+    # syscalls) with a few large ones without delaying the output noticeably.
+
+    def __init__(self, stream, max_size=1 << 16, max_delay=0.5):
+        self.stream = stream
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self._lock = threading.RLock()
+        self._chunks = []
+        self._size = 0
+        self._wakeup = threading.Event()
+        self._flusher = None
+
+    def write(self, text):
+        if not text:
+            return
+        with self._lock:
+            self._chunks.append(text)
+            self._size += len(text)
+            if self._size >= self.max_size:
+                self._flush()
+            else:
+                if self._flusher is None:
+                    self._flusher = threading.Thread(
+                        target=self._flush_periodically, daemon=True
+                    )
+                    self._flusher.start()
+                self._wakeup.set()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if self._chunks:
+            text = "".join(self._chunks)
+            self._chunks = []
+            self._size = 0
+            self.stream.write(text)
+        self.stream.flush()
+
+    def _flush_periodically(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            time.sleep(self.max_delay)
+            self.flush()
+
+
+_stdout = _BufferedOutput(sys.stdout)
+
+
+def output(text):
+    _stdout.write(text)
+
+
+def output_flush():
+    _stdout.flush()
+
+
 def info(message):
-    print(message, file=sys.stdout, flush=True)
+    output(message + "\n")
 
 
 def warn(message):
+    # Keep the order of the messages in the merged log:
+    output_flush()
     print(message, file=sys.stderr, flush=True)
 
 
+class _OrderedStream(object):
+    # Wraps the standard error stream to flush the buffered standard output
+    # before each write, so that the messages that bypass warn() (e.g. the ones
+    # of the logging module, which GitPython uses to report the errors of git,
+    # and tracebacks) keep their order in the merged log.
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        output_flush()
+        return self.stream.write(text)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+# Time of the last reported line and the last suppressed line of each progress
+# phase:
+_progress_lock = threading.Lock()
+_progress_phases = {}
+
+
+def progress(phase, line, final=False, interval=1.0):
+    # Reports the progress line at most once per INTERVAL seconds for each
+    # PHASE; the final line of the phase is always reported:
+    now = time.monotonic()
+    with _progress_lock:
+        last_time, _ = _progress_phases.get(phase, (None, None))
+        if final:
+            _progress_phases.pop(phase, None)
+        elif last_time is not None and now - last_time < interval:
+            _progress_phases[phase] = (last_time, line)
+            return
+        else:
+            _progress_phases[phase] = (now, None)
+    info(line)
+
+
+def progress_flush():
+    # Reports the last suppressed lines of the unfinished progress phases:
+    with _progress_lock:
+        lines = [line for _, line in _progress_phases.values() if line]
+        _progress_phases.clear()
+    for line in lines:
+        info(line)
+
+
+def output_setup():
+    # Makes sure that the buffered output, including the last suppressed lines
+    # of the unfinished progress phases, is not lost when the program exits,
+    # including termination with SIGTERM and SIGHUP (the default handlers of
+    # which skip the cleanup), and that the standard error stream keeps the
+    # order of the messages:
+    import atexit
+    import signal
+
+    if not isinstance(sys.stderr, _OrderedStream):
+        sys.stderr = _OrderedStream(sys.stderr)
+
+    # The handlers are called in the reverse order:
+    atexit.register(output_flush)
+    atexit.register(progress_flush)
+
+    def terminate(signum, _):
+        progress_flush()
+        sys.exit(128 + signum)
+
+    for signum in (signal.SIGTERM, signal.SIGHUP):
+        signal.signal(signum, terminate)
+
+
+# Accumulated metrics: spans are mapped to dictionaries with the number of
+# occurrences, the total and the maximum duration in seconds, counters are
+# mapped to their values:
+_metrics_lock = threading.Lock()
+_metrics_spans = {}
+_metrics_counters = {}
+
+
+def metrics_record(name, duration):
+    with _metrics_lock:
+        span = _metrics_spans.get(name, None)
+        if span is None:
+            span = {"count": 0, "total": 0.0, "max": 0.0}
+            _metrics_spans[name] = span
+        span["count"] += 1
+        span["total"] += duration
+        span["max"] = max(span["max"], duration)
+
+
+def metrics_count(name, value=1):
+    with _metrics_lock:
+        _metrics_counters[name] = _metrics_counters.get(name, 0) + value
+
+
+@contextmanager
+def metrics_span(name):
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        metrics_record(name, time.monotonic() - start)
+
+
+def metrics_report(metrics_file, command):
+    with _metrics_lock:
+        report = {
+            "command": command,
+            "spans": {k: dict(v) for k, v in _metrics_spans.items()},
+            "counters": dict(_metrics_counters),
+        }
+
+    with open(metrics_file, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+    summary = [
+        "{0} {1:.3f}s ({2})".format(k, v["total"], v["count"])
+        for k, v in sorted(
+            report["spans"].items(), key=lambda kv: -kv[1]["total"]
+        )
+    ]
+    summary.extend(
+        "{0} {1}".format(k, v) for k, v in sorted(report["counters"].items())
+    )
+    warn("Metrics for '{0}': {1}".format(command, "; ".join(summary)))
+
+
+def poll_sleep(seconds):
+    with metrics_span("poll.sleep"):
+        time.sleep(seconds)
+
+
+PROFILER_CPROFILE = "cprofile"
+PROFILER_TRACEMALLOC = "tracemalloc"
+
+
+def _collapsed_stacks(stats, min_time=1e-5, max_depth=128):
+    # Reconstructs the call stacks from the cProfile statistics in the format
+    # of the collapsed stacks (one line per stack, frames separated with
+    # semicolons, followed by the self time in microseconds). The self time of
+    # a function is split between its callers in proportion to the cumulative
+    # time the function spent when called by each of them.
+    callees = {}
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, caller_stats in callers.items():
+            callees.setdefault(caller, []).append((func, caller_stats[3]))
+
+    def frame(func):
+        filename, line, name = func
+        if filename == "~" and line == 0:
+            return name
+        return "{0}:{1}({2})".format(os.path.basename(filename), line, name)
+
+    stacks = {}
+
+    def walk(func, path, share):
+        _, _, tt, ct, _ = stats[func]
+        path = path + [func]
+        if tt * share >= min_time:
+            key = ";".join(frame(f) for f in path)
+            stacks[key] = stacks.get(key, 0) + tt * share
+        if len(path) >= max_depth:
+            return
+        for callee, callee_ct in callees.get(func, []):
+            callee_total = stats[callee][3]
+            if callee in path or callee_total <= 0:
+                continue
+            callee_share = share * callee_ct / callee_total
+            if stats[callee][3] * callee_share >= min_time:
+                walk(callee, path, callee_share)
+
+    for func, (_, _, _, _, callers) in stats.items():
+        if not callers:
+            walk(func, [], 1.0)
+
+    return [
+        "{0} {1}".format(stack, int(value * 1e6))
+        for stack, value in sorted(stacks.items())
+        if int(value * 1e6) > 0
+    ]
+
+
+@contextmanager
+def profiling(directory, profilers, name, top=50):
+    # Profiles the enclosed code with cProfile and/or tracemalloc and writes
+    # the results to the directory when the code exits in any way, including
+    # exit() and exceptions:
+    if not directory:
+        yield
+        return
+
+    import cProfile
+    import pstats
+    import tracemalloc
+
+    profile = None
+    if PROFILER_CPROFILE in profilers:
+        profile = cProfile.Profile()
+    if PROFILER_TRACEMALLOC in profilers:
+        tracemalloc.start(25)
+    if profile is not None:
+        profile.enable()
+
+    try:
+        yield
+    finally:
+        if profile is not None:
+            profile.disable()
+
+        # Stop tracing the memory allocations before the post-processing of the
+        # cProfile data, which would be slowed down considerably otherwise:
+        snapshot = None
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        os.makedirs(directory, exist_ok=True)
+        prefix = os.path.join(directory, "{0}-{1}".format(name, os.getpid()))
+
+        if profile is not None:
+            profile.dump_stats(prefix + ".pstats")
+            with open(prefix + ".collapsed", "w") as f:
+                stats = pstats.Stats(profile).stats
+                f.writelines(line + "\n" for line in _collapsed_stacks(stats))
+            with open(prefix + ".txt", "w") as f:
+                pstats.Stats(profile, stream=f).sort_stats(
+                    "cumulative"
+                ).print_stats(top)
+
+        if snapshot is not None:
+            snapshot = snapshot.filter_traces(
+                [tracemalloc.Filter(False, tracemalloc.__file__)]
+            )
+            with open(prefix + ".tracemalloc", "w") as f:
+                f.write("Peak traced memory: {0} bytes\n".format(peak))
+                for statistic in snapshot.statistics("traceback")[:top]:
+                    f.write(
+                        "\n{0}: {1} bytes in {2} blocks\n".format(
+                            statistic.traceback[-1],
+                            statistic.size,
+                            statistic.count,
+                        )
+                    )
+                    f.writelines(
+                        "    {0}\n".format(line)
+                        for line in statistic.traceback.format(
+                            limit=10, most_recent_first=True
+                        )
+                    )
+
+        warn("Profiling data is written to '{0}.*'".format(prefix))
+
+
+_size_units = {"bytes": 1, "KiB": 1 << 10, "MiB": 1 << 20, "GiB": 1 << 30}
+_size_regex = re.compile(
+    r"(\d+(?:\.\d+)?) ({0})(?!/s)".format("|".join(_size_units))
+)
+
+
+def parse_size(message):
+    # Returns the first size (e.g. '1.17 MiB') found in a git progress message
+    # in bytes, or None if there is none:
+    match = _size_regex.search(message)
+    if match:
+        return int(float(match.group(1)) * _size_units[match.group(2)])
+    return None
+
+
+def _gitlab_response_hook(response, *args, **kwargs):
+    metrics_record("gitlab.request", response.elapsed.total_seconds())
+    content_length = response.headers.get("Content-Length", None)
+    if content_length:
+        metrics_count("gitlab.response_bytes", int(content_length))
+
+
+def gitlab_server(url, **kwargs):
+    # Local import of a non-standard package, which makes it possible to get the
+    # help message even if the package is not available:
+    import gitlab
+
+    server = gitlab.Gitlab(url=url, **kwargs)
+    server.session.hooks["response"].append(_gitlab_response_hook)
+    return server
+
+
+def gitlab_report_pipeline(pipeline):
+    info(
+        "Pipeline for '{0}' (SHA: {1}): {2} ({3})".format(
+            pipeline.ref,
+            pipeline.sha[:8],
+            pipeline.status,
+            pipeline.web_url,
+        )
+    )
+
+
+def gitlab_pipeline_jobs(pipeline):
+    # Returns an iterator over all jobs of the pipeline, which are requested in
+    # large pages:
+    return pipeline.jobs.list(iterator=True, per_page=100)
+
+
+class GitlabJobIndex(object):
+    # Index of the jobs of a pipeline and of its downstream (child and
+    # multi-project) pipelines by name, which keeps the newest attempt of each
+    # job. The job lists are requested in large pages including the retried
+    # jobs. Since GitLab lists the jobs in the descending order of their IDs,
+    # subsequent updates stop paging at the first known job once the order has
+    # been confirmed by a listing of at least two jobs, i.e. only the new jobs
+    # are requested.
+
+    def __init__(self, project, pipeline_id, downstream=True):
+        self.project = project
+        self.pipeline_id = int(pipeline_id)
+        self.downstream = downstream
+        self._projects = {}
+        # Pipeline IDs mapped to the projects they belong to:
+        self._pipelines = {self.pipeline_id: project}
+        # Pipeline IDs mapped to the sets of the known job IDs:
+        self._known = {}
+        # Pipeline IDs mapped to whether their jobs are listed in the
+        # descending order (None until it is known):
+        self._descending = {}
+        # Job names mapped to dictionaries that map pipeline IDs to the newest
+        # jobs:
+        self._jobs = {}
+
+    def _project(self, project_id):
+        project = self._projects.get(project_id, None)
+        if project is None:
+            project = self.project.manager.gitlab.projects.get(
+                project_id, lazy=True
+            )
+            self._projects[project_id] = project
+        return project
+
+    def _update_jobs(self, pipeline_id):
+        known = self._known.setdefault(pipeline_id, set())
+        descending = self._descending.get(pipeline_id, None)
+        pipeline = self._pipelines[pipeline_id].pipelines.get(
+            pipeline_id, lazy=True
+        )
+        previous_id = None
+        for job in pipeline.jobs.list(
+            iterator=True, per_page=100, include_retried=True
+        ):
+            if previous_id is not None:
+                if job.id > previous_id:
+                    descending = False
+                elif descending is None:
+                    descending = True
+            previous_id = job.id
+            if job.id in known:
+                if descending:
+                    break
+                continue
+            known.add(job.id)
+            jobs = self._jobs.setdefault(job.name, {})
+            newest = jobs.get(pipeline_id, None)
+            if newest is None or newest.id < job.id:
+                jobs[pipeline_id] = job
+        self._descending[pipeline_id] = descending
+        return pipeline
+
+    def update(self):
+        # Requests the new jobs of the known pipelines and the new downstream
+        # pipelines:
+        pending = list(self._pipelines)
+        while pending:
+            pipeline_id = pending.pop(0)
+            pipeline = self._update_jobs(pipeline_id)
+            if not self.downstream:
+                continue
+            for bridge in pipeline.bridges.list(iterator=True, per_page=100):
+                downstream = bridge.attributes.get("downstream_pipeline", None)
+                if downstream and downstream["id"] not in self._pipelines:
+                    self._pipelines[downstream["id"]] = self._project(
+                        downstream["project_id"]
+                    )
+                    pending.append(downstream["id"])
+
+    def jobs(self):
+        # Returns the list of tuples (project, job) for the newest attempts of
+        # the jobs in the order of their IDs:
+        return sorted(
+            (
+                (self._pipelines[pipeline_id], job)
+                for jobs in self._jobs.values()
+                for pipeline_id, job in jobs.items()
+            ),
+            key=lambda entry: entry[1].id,
+        )
+
+    def find(self, name):
+        # Returns a tuple (project, job) for the newest attempt of the job with
+        # the name or None if there is no such job. The job of the requested
+        # pipeline takes precedence over the jobs of the downstream pipelines,
+        # which must have unique names otherwise:
+        jobs = self._jobs.get(name, {})
+        job = jobs.get(self.pipeline_id, None)
+        if job is not None:
+            return self.project, job
+        if len(jobs) > 1:
+            raise GHCLAssertionError(
+                "ambiguous job name: jobs in pipelines {0} have name "
+                "'{1}'".format(", ".join(str(p) for p in sorted(jobs)), name)
+            )
+        for pipeline_id, job in jobs.items():
+            return self._pipelines[pipeline_id], job
+        return None
+
+
+def gitlab_attach_pipeline(pipeline, poll_timeout):
+    # Waits for the pipeline to reach a final status reporting the statuses of
+    # its jobs after each poll:
+    poll_timeout = 0 if poll_timeout < 0 else poll_timeout
+
+    while pipeline.status not in PIPELINE_FINAL_STATUSES:
+        poll_sleep(poll_timeout)
+        pipeline.refresh()
+        for job in pipeline.jobs.list():
+            info(
+                "\tjob '{0}': {1} ({2})".format(
+                    job.name, job.status, job.web_url
+                )
+            )
+
+    gitlab_report_pipeline(pipeline)
+
+
+def gitlab_ref_manager(project, ref_type):
+    if ref_type == BRANCH:
+        return project.branches
+    elif ref_type == TAG:
+        return project.tags
+    else:
+        raise GHCLAssertionError(
+            "unexpected reference type {0}".format(ref_type)
+        )
+
+
+def gitlab_commit_exists(project, commit):
+    # Local import of a non-standard package, which makes it possible to get the
+    # help message even if the package is not available:
+    from gitlab.exceptions import GitlabGetError
+
+    try:
+        project.commits.get(commit)
+    except GitlabGetError as e:
+        if e.response_code == 404:
+            return False
+        raise
+    return True
+
+
+def gitlab_create_ref(project, ref_type, ref_name, commit, ref_message=None):
+    # Creates a branch or a (lightweight or annotated) tag for the commit that
+    # already exists in the GitLab repository:
+    if ref_type == BRANCH:
+        data = {"branch": ref_name, "ref": commit}
+    else:
+        data = {"tag_name": ref_name, "ref": commit}
+        if ref_message:
+            data["message"] = ref_message
+    return gitlab_ref_manager(project, ref_type).create(data)
+
+
 @contextmanager
 def git_config(repo, config):
     # Backup git configuration sections that we need to modify:
@@ -50,27 +590,29 @@ def git_config(repo, config):
 
     try:
         # Apply the required modifications of the git configuration:
-        for scope, sections in config.items():
-            with repo.config_writer(config_level=scope) as writer:
-                for section, options in sections.items():
-                    for option, value in options.items():
-                        writer.set_value(section, option, value)
+        with metrics_span("git_config.setup"):
+            for scope, sections in config.items():
+                with repo.config_writer(config_level=scope) as writer:
+                    for section, options in sections.items():
+                        for option, value in options.items():
+                            writer.set_value(section, option, value)
         yield
     finally:
         # Restore git configuration from the backup:
-        for scope, sections in config.items():
-            with repo.config_writer(config_level=scope) as writer:
-                scope_backup = config_backup[scope]
-                for section, options in sections.items():
-                    if section in scope_backup:
-                        section_backup = scope_backup[section]
-                        for option in options.keys():
-                            writer.remove_option(section, option)
-                            if option in section_backup:
-                                for value in section_backup[option]:
-                                    writer.add_value(section, option, value)
-                    else:
-                        writer.remove_section(section)
+        with metrics_span("git_config.restore"):
+            for scope, sections in config.items():
+                with repo.config_writer(config_level=scope) as writer:
+                    scope_backup = config_backup[scope]
+                    for section, options in sections.items():
+                        if section in scope_backup:
+                            section_backup = scope_backup[section]
+                            for option in options.keys():
+                                writer.remove_option(section, option)
+                                if option in section_backup:
+                                    for value in section_backup[option]:
+                                        writer.add_value(section, option, value)
+                        else:
+                            writer.remove_section(section)
 
 
 @contextmanager
@@ -103,19 +645,21 @@ def git_signing(repo, signing_format=SIGNING_FORMAT_NONE, signing_key=None):
 
 @contextmanager
 def git_keep_head(repo):
-    do_stash = repo.is_dirty() or bool(repo.untracked_files)
-    if do_stash:
-        repo.git.stash("push", "--all")
-    if repo.head.is_detached:
-        head_backup = repo.head.commit
-    else:
-        head_backup = repo.head.reference
+    with metrics_span("git_keep_head.setup"):
+        do_stash = repo.is_dirty() or bool(repo.untracked_files)
+        if do_stash:
+            repo.git.stash("push", "--all")
+        if repo.head.is_detached:
+            head_backup = repo.head.commit
+        else:
+            head_backup = repo.head.reference
     try:
         yield
     finally:
-        repo.head.reference = head_backup
-        if do_stash:
-            repo.git.stash("pop", "--index")
+        with metrics_span("git_keep_head.restore"):
+            repo.head.reference = head_backup
+            if do_stash:
+                repo.git.stash("pop", "--index")
 
 
 @contextmanager
@@ -130,6 +674,8 @@ def git_ref_exists_and_unique(repo, ref_type, ref_name, commit, **kwargs):
                 return repo.create_tag(uuid.uuid4(), r.path, None)
         return None
 
+    ref_setup_start = time.monotonic()
+
     # Back up references with conflicting names:
     tag_backup = backup_ref(ref_name, repo.tags)
     branch_backup = backup_ref(ref_name, repo.branches)
@@ -181,20 +727,24 @@ def git_ref_exists_and_unique(repo, ref_type, ref_name, commit, **kwargs):
                 "unexpected reference type {0}".format(ref_type)
             )
 
+        metrics_record("git_ref.setup", time.monotonic() - ref_setup_start)
         yield
     finally:
-        # Delete the requested reference:
-        if ref_type == TAG:
-            repo.delete_tag(ref_name)
-        elif ref_type == BRANCH:
-            repo.delete_head(ref_name, force=True)
-        cleanup_and_restore()
+        with metrics_span("git_ref.restore"):
+            # Delete the requested reference:
+            if ref_type == TAG:
+                repo.delete_tag(ref_name)
+            elif ref_type == BRANCH:
+                repo.delete_head(ref_name, force=True)
+            cleanup_and_restore()
 
 
 @contextmanager
 def git_remote(repo, remote_url):
     remote_name = uuid.uuid4().hex
-    remote = repo.create_remote(remote_name, remote_url)
+    with metrics_span("git_remote.setup"):
+        remote = repo.create_remote(remote_name, remote_url)
     yield remote
-    if remote_name in repo.remotes:
-        repo.delete_remote(repo.remote(remote_name))
+    with metrics_span("git_remote.restore"):
+        if remote_name in repo.remotes:
+            repo.delete_remote(repo.remote(remote_name))